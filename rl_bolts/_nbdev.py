@@ -6,6 +6,8 @@ index = {"color2num": "00_utils.ipynb",
          "colorize": "00_utils.ipynb",
          "calc_logstd_anneal": "00_utils.ipynb",
          "save_frames_as_gif": "00_utils.ipynb",
+         "discount_cumsum": "00_utils.ipynb",
+         "calc_gae": "00_utils.ipynb",
          "conv2d_output_size": "00_utils.ipynb",
          "num2tuple": "00_utils.ipynb",
          "conv2d_output_shape": "00_utils.ipynb",
@@ -14,8 +16,14 @@ index = {"color2num": "00_utils.ipynb",
          "printdict": "00_utils.ipynb",
          "PolicyGradientRLDataset": "01_datasets.ipynb",
          "QPolicyGradientRLDataset": "01_datasets.ipynb",
+         "MinibatchRLDataset": "01_datasets.ipynb",
          "PGBuffer": "02_buffers.ipynb",
+         "VecPGBuffer": "02_buffers.ipynb",
+         "SharedPGBuffer": "02_buffers.ipynb",
          "ReplayBuffer": "02_buffers.ipynb",
+         "ConcurrentReplayBuffer": "02_buffers.ipynb",
+         "SumTree": "02_buffers.ipynb",
+         "PrioritizedReplayBuffer": "02_buffers.ipynb",
          "MLP": "03_neuralnets.ipynb",
          "CNN": "03_neuralnets.ipynb",
          "Actor": "03_neuralnets.ipynb",
@@ -35,10 +43,23 @@ index = {"color2num": "00_utils.ipynb",
          "sac_policy_loss": "04_losses.ipynb",
          "sac_qfunc_loss": "04_losses.ipynb",
          "ToTorchWrapper": "05_env_wrappers.ipynb",
+         "RunningMeanStd": "05_env_wrappers.ipynb",
          "StateNormalizeWrapper": "05_env_wrappers.ipynb",
          "RewardScalerWrapper": "05_env_wrappers.ipynb",
          "BestPracticesWrapper": "05_env_wrappers.ipynb",
+         "VecToTorchWrapper": "05_env_wrappers.ipynb",
+         "VecStateNormalizeWrapper": "05_env_wrappers.ipynb",
+         "VecRewardScalerWrapper": "05_env_wrappers.ipynb",
+         "LazyFrames": "05_env_wrappers.ipynb",
+         "FrameStackWrapper": "05_env_wrappers.ipynb",
+         "ActionRepeatWrapper": "05_env_wrappers.ipynb",
+         "EpisodeStats": "06_loops.ipynb",
+         "InfoAggregator": "06_loops.ipynb",
          "polgrad_interaction_loop": "06_loops.ipynb",
+         "vec_polgrad_interaction_loop": "06_loops.ipynb",
+         "RolloutWorkerPool": "06_loops.ipynb",
+         "AsyncRolloutCollector": "06_loops.ipynb",
+         "offpolicy_interaction_loop": "06_loops.ipynb",
          "PPO": "07_algorithms.ipynb"}
 
 modules = ["utils.py",
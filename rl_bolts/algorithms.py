@@ -11,14 +11,20 @@ import torch.nn.functional as F
 from rl_bolts import neuralnets as nns
 from rl_bolts import losses as l
 from .env_wrappers import BestPracticesWrapper, ToTorchWrapper, StateNormalizeWrapper
-from .buffers import PGBuffer
-from .datasets import PolicyGradientRLDataset
-from .loops import polgrad_interaction_loop
+from .buffers import PGBuffer, SharedPGBuffer
+from .datasets import MinibatchRLDataset
+from .loops import polgrad_interaction_loop, RolloutWorkerPool, AsyncRolloutCollector, InfoAggregator
+from functools import partial
 import rl_bolts.utils as utils
 import pytorch_lightning as pl
 from argparse import Namespace
 from typing import Optional, Union
 
+# Cell
+def _make_torch_env(env_name: str) -> gym.Env:
+    """Make a gym environment wrapped in `ToTorchWrapper`. Defined at module level so worker processes can unpickle it."""
+    return ToTorchWrapper(gym.make(env_name))
+
 # Cell
 class PPO(pl.LightningModule):
     """
@@ -41,6 +47,11 @@ class PPO(pl.LightningModule):
     - seed (int): Random seed for pytorch and numpy
     - evaluate (bool): Whether to run eval episodes at the end of each epoch. Saves episodes using gym.wrappers.Monitor.
     - monitor_dir (str): Directory for monitor to write to. Default is /tmp
+    - num_workers (int): Number of worker processes to collect interactions in parallel. If 0, interactions are
+    collected in this process. `batch_size` has to be divisible by it.
+    - async_collection (bool): Whether to collect the next batch in the background while training on the current one.
+    The batch is then collected by the policy from one epoch earlier; its log probabilities are recomputed under the
+    current policy and its advantages are reweighted by truncated importance weights.
     """
     def __init__(
         self,
@@ -56,7 +67,9 @@ class PPO(pl.LightningModule):
         maxkl: Optional[float] = 0.01,
         seed: Optional[int] = 0,
         evaluate: Optional[bool] = True,
-        monitor_dir: Optional[str] = 'video_results'
+        monitor_dir: Optional[str] = 'video_results',
+        num_workers: Optional[int] = 0,
+        async_collection: Optional[bool] = False
     ):
         super().__init__()
 
@@ -81,8 +94,7 @@ class PPO(pl.LightningModule):
 
         self.hparams = hparams
 
-        env = gym.make(env)
-        self.env = ToTorchWrapper(env)
+        self.env = _make_torch_env(env)
 
         self.actor_critic = nns.ActorCritic(
             self.env.observation_space.shape[0],
@@ -100,17 +112,37 @@ class PPO(pl.LightningModule):
         self.evaluate = evaluate
 
         if self.evaluate:
-            eval_env = gym.wrappers.Monitor(env, monitor_dir, force=True)
+            # a separate env instance, since with async_collection the training env is stepped in the background
+            eval_env = gym.wrappers.Monitor(gym.make(env), monitor_dir, force=True)
             self.eval_env = ToTorchWrapper(eval_env)
 
         self.tracker_dict = {}
 
-        self.buffer = PGBuffer(
-            self.env.observation_space.shape,
-            self.env.action_space.shape,
-            size = self.batch_size,
-            gamma = self.gamma
-        )
+        self.num_workers = num_workers
+        if self.num_workers > 0:
+            assert self.batch_size % self.num_workers == 0, "batch_size has to be divisible by num_workers"
+            self.buffer = SharedPGBuffer(
+                self.env.observation_space.shape,
+                self.env.action_space.shape,
+                num_workers = self.num_workers,
+                worker_size = self.batch_size // self.num_workers,
+                gamma = self.gamma
+            )
+            self.rollout_workers = RolloutWorkerPool(
+                partial(_make_torch_env, self.hparams.env), self.actor_critic, self.buffer, seed=seed
+            )
+        else:
+            self.buffer = PGBuffer(
+                self.env.observation_space.shape,
+                self.env.action_space.shape,
+                size = self.batch_size,
+                gamma = self.gamma
+            )
+
+        self.policy_version = 0
+        self.async_collection = async_collection
+        if self.async_collection:
+            self.collector = AsyncRolloutCollector(self.collect, self.actor_critic)
 
         self.inner_loop()
 
@@ -171,20 +203,61 @@ class PPO(pl.LightningModule):
         log.update(self.tracker_dict)
         return {"loss": loss, "log": log, "progress_bar": log}
 
+    def collect(self, agent: nn.Module):
+        if self.num_workers > 0:
+            return self.rollout_workers.collect(agent)
+        # env infos aren't used, so don't keep them around
+        return polgrad_interaction_loop(
+            self.env, agent, self.buffer, self.batch_size, info_agg=InfoAggregator(keys=[]), defer_values=True
+        )
+
     def inner_loop(self) -> None:
-        buffer, infos, _ = polgrad_interaction_loop(self.env, self.actor_critic, self.buffer, self.batch_size)
-        self.data = buffer.get()
+        if self.async_collection:
+            if not self.collector.running:
+                self.collector.start(self.actor_critic, self.policy_version)
+            self.data, infos, version = self.collector.wait()
+            # collect the next batch with the current weights while this one trains
+            self.collector.start(self.actor_critic, self.policy_version)
+            infos["PolicyLag"] = self.policy_version - version
+            if infos["PolicyLag"] > 0:
+                self.data = self.correct_stale_batch(self.data)
+        else:
+            buffer, infos = self.collect(self.actor_critic)[:2]
+            self.data = buffer.get()
         self.tracker_dict.update(infos)
 
+    def correct_stale_batch(self, data: list) -> list:
+        """
+        Re-base a batch collected by an older policy on the current one.
+
+        The behavior log probabilities are replaced by the current policy's, so the PPO clip range is measured from the
+        current policy. Advantages are scaled by truncated importance weights min(1, pi / pi_behavior) to account for
+        the actions having been sampled by the older policy.
+        """
+        states, actions, advs, rets, logps_behavior = data
+        with torch.no_grad():
+            _, logps = self.actor_critic.policy(states, actions)
+        is_weights = torch.exp(logps - logps_behavior).clamp(max=1.)
+        self.tracker_dict["MeanISWeight"] = is_weights.mean().item()
+        return [states, actions, advs * is_weights, rets, logps]
+
     def on_epoch_end(self):
         utils.printdict(self.tracker_dict)
         self.tracker_dict = {}
+        self.policy_version += 1
         self.inner_loop()
         self.eval_episodes(n_episodes=1)
 
+    def on_train_end(self):
+        if self.async_collection and self.collector.running:
+            self.collector.wait()
+        if self.num_workers > 0:
+            self.rollout_workers.close()
+
     def train_dataloader(self):
-        dataset = PolicyGradientRLDataset(self.data)
-        dataloader = torch.utils.data.DataLoader(dataset, batch_size=self.batch_size, sampler=None, num_workers=4)
+        # the buffer hands out ready-made batches, so there is nothing for the loader to collate or parallelize
+        dataset = MinibatchRLDataset(self.buffer, self.data, batch_size=self.batch_size, shuffle=False)
+        dataloader = torch.utils.data.DataLoader(dataset, batch_size=None)
         return dataloader
 
     def backward(self, *args, **kwargs):
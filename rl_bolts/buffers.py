@@ -1,13 +1,17 @@
 # AUTOGENERATED! DO NOT EDIT! File to edit: nbs/02_buffers.ipynb (unless otherwise specified).
 
-__all__ = ['PGBuffer', 'ReplayBuffer']
+__all__ = ['PGBuffer', 'VecPGBuffer', 'SharedPGBuffer', 'ReplayBuffer', 'ConcurrentReplayBuffer', 'SumTree',
+           'PrioritizedReplayBuffer']
 
 # Cell
 import numpy as np
-from scipy.signal import lfilter
 from typing import Optional, Any, Union
 import torch
 import gym
+import os
+import json
+import threading
+from rl_bolts import utils
 
 # Cell
 class PGBuffer:
@@ -25,6 +29,10 @@ class PGBuffer:
     - size (int): buffer size.
     - gamma (float): reward discount factor.
     - lam (float): Lambda parameter for GAE-Lambda advantage estimation
+    - obs_dtype (torch.dtype): Storage type for observations, e.g. torch.uint8 for pixels or torch.float16.
+    Observations are cast back to float32 only when read out of the buffer.
+    - act_dtype (torch.dtype): Storage type for actions.
+    - obs_scale (float): Factor applied to observations when they are read out, e.g. 1 / 255 for uint8 pixels.
     """
     def __init__(
         self,
@@ -33,15 +41,19 @@ class PGBuffer:
         size: int,
         gamma: Optional[float] = 0.99,
         lam: Optional[float] = 0.95,
+        obs_dtype: Optional[torch.dtype] = torch.float32,
+        act_dtype: Optional[torch.dtype] = torch.float32,
+        obs_scale: Optional[float] = 1.,
     ):
-        self.obs_buf = torch.zeros(self._combined_shape(size, obs_dim), dtype=torch.float32)
-        self.act_buf = torch.zeros(self._combined_shape(size, act_dim), dtype=torch.float32)
-        self.adv_buf = np.zeros(size, dtype=np.float32)
-        self.rew_buf = np.zeros(size, dtype=np.float32)
-        self.ret_buf = np.zeros(size, dtype=np.float32)
-        self.val_buf = np.zeros(size, dtype=np.float32)
-        self.logp_buf = np.zeros(size, dtype=np.float32)
+        self.obs_buf = torch.zeros(self._combined_shape(size, obs_dim), dtype=obs_dtype)
+        self.act_buf = torch.zeros(self._combined_shape(size, act_dim), dtype=act_dtype)
+        self.adv_buf = torch.zeros(size, dtype=torch.float32)
+        self.rew_buf = torch.zeros(size, dtype=torch.float32)
+        self.ret_buf = torch.zeros(size, dtype=torch.float32)
+        self.val_buf = torch.zeros(size, dtype=torch.float32)
+        self.logp_buf = torch.zeros(size, dtype=torch.float32)
         self.gamma, self.lam = gamma, lam
+        self.obs_scale = obs_scale
         self.ptr, self.path_start_idx, self.max_size = 0, 0, size
 
     def store(
@@ -65,12 +77,39 @@ class PGBuffer:
         assert self.ptr < self.max_size  # buffer has to have room so you can store
         self.obs_buf[self.ptr] = obs
         self.act_buf[self.ptr] = act
-        self.rew_buf[self.ptr] = rew
-        self.val_buf[self.ptr] = val
-        self.logp_buf[self.ptr] = logp
+        self._view("rew_buf")[self.ptr] = rew
+        self._view("val_buf")[self.ptr] = val
+        self._view("logp_buf")[self.ptr] = logp
         self.ptr += 1
 
-    def finish_path(self, last_val: Optional[Union[int, float, np.array]] = 0):
+    def store_batch(
+        self,
+        obs: torch.Tensor,
+        act: torch.Tensor,
+        rew: Union[np.array, torch.Tensor],
+        val: Union[np.array, torch.Tensor],
+        logp: Union[np.array, torch.Tensor],
+    ):
+        """
+        Append a contiguous block of T timesteps of agent-environment interaction to the buffer in one go.
+
+        Args:
+        - obs (torch.Tensor): Observations, shape (T, *obs_dim).
+        - act (torch.Tensor): Actions, shape (T, *act_dim).
+        - rew (np.array or torch.Tensor): Rewards from environment, shape (T,).
+        - val (np.array or torch.Tensor): Value estimates for the states, shape (T,).
+        - logp (np.array or torch.Tensor): log probabilities of chosen actions under current policy distribution, shape (T,).
+        """
+        block = slice(self.ptr, self.ptr + len(obs))
+        assert block.stop <= self.max_size  # buffer has to have room so you can store
+        self.obs_buf[block] = torch.as_tensor(obs).to(self.obs_buf.dtype)
+        self.act_buf[block] = torch.as_tensor(act).to(self.act_buf.dtype).reshape(self.act_buf[block].shape)
+        self.rew_buf[block] = torch.as_tensor(rew, dtype=torch.float32)
+        self.val_buf[block] = torch.as_tensor(val, dtype=torch.float32)
+        self.logp_buf[block] = torch.as_tensor(logp, dtype=torch.float32)
+        self.ptr = block.stop
+
+    def finish_path(self, last_val: Optional[Union[int, float, torch.Tensor]] = 0):
         """
         Call this at the end of a trajectory, or when one gets cut off
         by an epoch ending. This looks back in the buffer to where the
@@ -85,19 +124,48 @@ class PGBuffer:
         for timesteps beyond the arbitrary episode horizon (or epoch cutoff).
 
         Args:
-        - last_val (int or float or np.array): Estimate of rewards-to-go. If trajectory ended, is 0.
+        - last_val (int or float or torch.Tensor): Estimate of rewards-to-go. If trajectory ended, is 0.
         """
 
         path_slice = slice(self.path_start_idx, self.ptr)
-        rews = np.append(self.rew_buf[path_slice], last_val)
-        vals = np.append(self.val_buf[path_slice], last_val)
 
-        # the next two lines implement GAE-Lambda advantage calculation
-        deltas = rews[:-1] + self.gamma * vals[1:] - vals[:-1]
-        self.adv_buf[path_slice] = self._discount_cumsum(deltas, self.gamma * self.lam)
+        # GAE-Lambda advantages, and rewards-to-go to be targets for the value function
+        self.adv_buf[path_slice], self.ret_buf[path_slice] = utils.calc_gae(
+            self.rew_buf[path_slice], self.val_buf[path_slice], last_val, self.gamma, self.lam
+        )
+
+        self.path_start_idx = self.ptr
+
+    def finish_paths(
+        self,
+        ends: Union[list, np.array],
+        last_vals: Union[list, np.array, torch.Tensor],
+    ):
+        """
+        Finish several trajectories stored back to back since the last call, computing advantages and rewards-to-go
+        for all of them at once. Equivalent to calling `finish_path` at the end of each one.
+
+        Args:
+        - ends (list or np.array): Buffer index just past the last step of each trajectory, in increasing order.
+        The last one must be the current write position.
+        - last_vals (list or np.array or torch.Tensor): `last_val` for each trajectory; 0 for ones which ended in a
+        terminal state, otherwise V(s_T).
+        """
+        ends = np.asarray(ends, dtype=np.int64)
+        last_vals = torch.as_tensor(last_vals, dtype=torch.float32).reshape(len(ends))
+        assert ends[-1] == self.ptr, "the last trajectory has to end at the write position"
+
+        path_slice = slice(self.path_start_idx, self.ptr)
+        rews = self.rew_buf[path_slice].clone()
+        dones = torch.zeros_like(rews)
+        # earlier trajectories end inside the block: mark them done and fold their bootstrap values into the reward
+        inner_ends = torch.as_tensor(ends[:-1] - self.path_start_idx - 1)
+        dones[inner_ends] = 1.
+        rews[inner_ends] += self.gamma * last_vals[:-1]
 
-        # the next line computes rewards-to-go, to be targets for the value function
-        self.ret_buf[path_slice] = self._discount_cumsum(rews, self.gamma)[:-1]
+        self.adv_buf[path_slice], self.ret_buf[path_slice] = utils.calc_gae(
+            rews, self.val_buf[path_slice], last_vals[-1], self.gamma, self.lam, dones
+        )
 
         self.path_start_idx = self.ptr
 
@@ -117,16 +185,141 @@ class PGBuffer:
         assert self.ptr == self.max_size  # buffer has to be full before you can get
         self.ptr, self.path_start_idx = 0, 0
         # the line implement the advantage normalization trick
-        adv_mean, adv_std = np.mean(self.adv_buf), np.std(self.adv_buf)
+        adv_mean, adv_std = self.adv_buf.mean(), self.adv_buf.std(unbiased=False)
         self.adv_buf = (self.adv_buf - adv_mean) / (adv_std + 1e-8)
         return [
-            self.obs_buf,
-            self.act_buf,
-            torch.as_tensor(self.adv_buf, dtype=torch.float32),
-            torch.as_tensor(self.ret_buf, dtype=torch.float32),
-            torch.as_tensor(self.logp_buf, dtype=torch.float32)
+            self._decode(self.obs_buf, self.obs_scale),
+            self._decode(self.act_buf),
+            self.adv_buf,
+            self.ret_buf,
+            self.logp_buf
         ]
 
+    def minibatches(
+        self,
+        batch_size: Optional[int] = 64,
+        epochs: Optional[int] = 1,
+        shuffle: Optional[bool] = True,
+        data: Optional[list] = None,
+    ):
+        """
+        Call this at the end of an epoch instead of `get` to iterate over the buffer contents in minibatches.
+
+        Each epoch draws one random permutation and gathers every minibatch with a single `index_select` per tensor.
+        Without shuffling, minibatches are slices of the buffer contents and no data is copied.
+
+        Args:
+        - batch_size (int): Number of interactions per minibatch. The last minibatch of an epoch may be smaller.
+        - epochs (int): Number of passes over the data.
+        - shuffle (bool): Whether to shuffle the data each epoch.
+        - data (list of torch.Tensor): Output of an earlier `get` call to iterate over. Defaults to calling `get` now.
+
+        Returns:
+        - generator of tuples of batch tensors: (obs, act, adv, ret, logp)
+        """
+        data = self.get() if data is None else data
+        return self._iterate_minibatches(data, batch_size, epochs, shuffle)
+
+    def _iterate_minibatches(self, data: list, batch_size: int, epochs: int, shuffle: bool):
+        """Generator behind `minibatches`, kept separate so `get` runs when `minibatches` is called."""
+        n = len(data[0])
+        for _ in range(epochs):
+            if not shuffle:
+                for start in range(0, n, batch_size):
+                    yield tuple(x[start:start + batch_size] for x in data)
+                continue
+            perm = torch.randperm(n)
+            for start in range(0, n, batch_size):
+                idxs = perm[start:start + batch_size]
+                yield tuple(torch.index_select(x, 0, idxs) for x in data)
+
+    def save(self, path: str):
+        """
+        Save a snapshot of the buffer to a directory: one raw .npy file per array, plus a meta.json holding the pointers
+        (`ptr`, `size`, `path_start_idx`) and settings. Arrays are streamed to disk in chunks without pickling, so
+        saving a large buffer is bounded by disk bandwidth.
+
+        Args:
+        - path (str): Directory to save to. Created if it doesn't exist.
+        """
+        os.makedirs(path, exist_ok=True)
+        meta, arrays = self._get_state()
+        for name, arr in arrays.items():
+            self._write_array(os.path.join(path, f"{name}.npy"), arr)
+        meta["arrays"] = list(arrays)
+        with open(os.path.join(path, "meta.json"), "w") as f:
+            json.dump(meta, f)
+
+    @classmethod
+    def load(cls, path: str):
+        """
+        Load a buffer saved with `save`.
+
+        The arrays are memory-mapped copy-on-write instead of being read in, so loading is fast whatever the buffer
+        size, and writing to the loaded buffer never modifies the snapshot on disk.
+
+        Args:
+        - path (str): Directory the buffer was saved to.
+
+        Returns:
+        - buffer: The loaded buffer.
+        """
+        with open(os.path.join(path, "meta.json")) as f:
+            meta = json.load(f)
+        arrays = {name: np.load(os.path.join(path, f"{name}.npy"), mmap_mode="c") for name in meta.pop("arrays")}
+        buf = cls.__new__(cls)
+        buf._set_state(meta, arrays)
+        return buf
+
+    def _get_state(self):
+        """
+        Split the buffer's attributes into JSON-serializable settings and arrays to save.
+
+        Returns:
+        - meta (dict): Scalar attributes, plus the names of the arrays which are torch Tensors.
+        - arrays (dict): NumPy views of the array attributes.
+        """
+        meta, arrays = {"tensors": []}, {}
+        for name, value in vars(self).items():
+            if isinstance(value, torch.Tensor):
+                arrays[name] = value.numpy()
+                meta["tensors"].append(name)
+            elif isinstance(value, np.ndarray):
+                arrays[name] = value
+            elif value is None or isinstance(value, (bool, int, float, str)):
+                meta[name] = value
+        return meta, arrays
+
+    def _set_state(self, meta: dict, arrays: dict):
+        """
+        Restore the attributes returned by `_get_state`.
+
+        Args:
+        - meta (dict): Scalar attributes, plus the names of the arrays which are torch Tensors.
+        - arrays (dict): Arrays to restore.
+        """
+        tensors = meta.pop("tensors")
+        for name, value in meta.items():
+            setattr(self, name, value)
+        for name, arr in arrays.items():
+            setattr(self, name, torch.from_numpy(arr) if name in tensors else arr)
+
+    def _write_array(self, path: str, arr: np.array, chunk_bytes: Optional[int] = 2 ** 26):
+        """
+        Write an array to a .npy file, `chunk_bytes` at a time.
+
+        Args:
+        - path (str): File to write.
+        - arr (np.array): Array to write.
+        - chunk_bytes (int): Approximate number of bytes to write per chunk.
+        """
+        arr = np.ascontiguousarray(arr)
+        rows_per_chunk = max(1, chunk_bytes // max(1, arr[:1].nbytes)) if arr.ndim > 0 else 1
+        with open(path, "wb") as f:
+            np.lib.format.write_array_header_1_0(f, np.lib.format.header_data_from_array_1_0(arr))
+            for start in range(0, len(arr) if arr.ndim > 0 else 1, rows_per_chunk):
+                f.write(memoryview(arr[start:start + rows_per_chunk] if arr.ndim > 0 else arr).cast("B"))
+
     def _combined_shape(
         self, length: Union[int, np.array], shape: Optional[Union[int, tuple]] = None
     ):
@@ -144,44 +337,467 @@ class PGBuffer:
             return (length,)
         return (length, shape) if np.isscalar(shape) else (length, *shape)
 
-    def _discount_cumsum(self, x: np.array, discount: float):
+    def _decode(self, x: torch.Tensor, scale: Optional[float] = 1.):
         """
-        magic from rllab for computing discounted cumulative sums of vectors.
-        input:
-            vector x,
-            [x0,
-            x1,
-            x2]
-        output:
-            [x0 + discount * x1 + discount^2 * x2,
-            x1 + discount * x2,
-            x2]
+        Cast stored data back to float32 and rescale it. Float32 data with no scaling is returned without a copy.
+
+        Args:
+        - x (torch.Tensor): Stored data.
+        - scale (float): Factor to multiply the data by.
+
+        Returns:
+        - x (torch.Tensor): float32 data.
+        """
+        if x.dtype != torch.float32:
+            x = x.to(torch.float32)
+        return x * scale if scale != 1. else x
+
+    def _view(self, name: str):
+        """
+        NumPy view of the tensor attribute `name`. Writing a scalar through the view is several times cheaper than
+        indexing the tensor, so `store` uses it for the per-step scalars. The view is cached and rebuilt whenever the
+        attribute is replaced, e.g. by `get` or `load`.
+
+        Args:
+        - name (str): Name of the tensor attribute.
+
+        Returns:
+        - view (np.ndarray): Array sharing memory with the tensor.
         """
-        return lfilter([1], [1, float(-discount)], x[::-1], axis=0)[::-1]
+        tensor = getattr(self, name)
+        views = self.__dict__.setdefault("_views", {})
+        cached = views.get(name)
+        if cached is None or cached[0] is not tensor:
+            cached = views[name] = (tensor, tensor.numpy())
+        return cached[1]
 
 # Cell
+class VecPGBuffer(PGBuffer):
+    """
+    A buffer for storing trajectories from several environments stepped in lockstep, using
+    Generalized Advantage Estimation (GAE-Lambda) for calculating the advantages of state-action pairs.
+
+    Each call to `store` writes one timestep for every environment, so data is kept in `(num_envs, size, ...)` arrays.
+    Episode boundaries are tracked with done masks, so advantages and rewards-to-go for every environment
+    and every episode are computed together in a single call to `finish_path` at the end of the rollout.
+
+    If an episode is cut off by a time limit instead of reaching a terminal state, fold the bootstrap value into
+    the stored reward (`rew + gamma * V(s_T)`) and mark the step as done, or leave that to `finish_paths`.
 
-class ReplayBuffer(PGBuffer):
+    Args:
+    - obs_dim (tuple or int): Dimensionality of input feature space.
+    - act_dim (tuple or int): Dimensionality of action space.
+    - num_envs (int): Number of environments stored side by side.
+    - size (int): Number of timesteps stored per environment. Total capacity is num_envs * size.
+    - gamma (float): reward discount factor.
+    - lam (float): Lambda parameter for GAE-Lambda advantage estimation
+    - obs_dtype (torch.dtype): Storage type for observations, e.g. torch.uint8 for pixels or torch.float16.
+    Observations are cast back to float32 only when read out of the buffer.
+    - act_dtype (torch.dtype): Storage type for actions.
+    - obs_scale (float): Factor applied to observations when they are read out, e.g. 1 / 255 for uint8 pixels.
     """
-    A replay buffer for off-policy RL agents.
+    def __init__(
+        self,
+        obs_dim: Union[tuple, int],
+        act_dim: Union[tuple, int],
+        num_envs: int,
+        size: int,
+        gamma: Optional[float] = 0.99,
+        lam: Optional[float] = 0.95,
+        obs_dtype: Optional[torch.dtype] = torch.float32,
+        act_dtype: Optional[torch.dtype] = torch.float32,
+        obs_scale: Optional[float] = 1.,
+    ):
+        self.obs_buf = torch.zeros(self._combined_shape(num_envs, self._combined_shape(size, obs_dim)), dtype=obs_dtype)
+        self.act_buf = torch.zeros(self._combined_shape(num_envs, self._combined_shape(size, act_dim)), dtype=act_dtype)
+        self.adv_buf = torch.zeros((num_envs, size), dtype=torch.float32)
+        self.rew_buf = torch.zeros((num_envs, size), dtype=torch.float32)
+        self.ret_buf = torch.zeros((num_envs, size), dtype=torch.float32)
+        self.val_buf = torch.zeros((num_envs, size), dtype=torch.float32)
+        self.logp_buf = torch.zeros((num_envs, size), dtype=torch.float32)
+        self.done_buf = torch.zeros((num_envs, size), dtype=torch.float32)
+        self.gamma, self.lam = gamma, lam
+        self.obs_scale = obs_scale
+        self.num_envs = num_envs
+        self.ptr, self.path_start_idx, self.max_size = 0, 0, size
 
-    This class is borrowed from OpenAI's SpinningUp package: https://spinningup.openai.com/en/latest/
+    def store(
+        self,
+        obs: torch.Tensor,
+        act: torch.Tensor,
+        rew: Union[np.array, torch.Tensor],
+        val: Union[np.array, torch.Tensor],
+        logp: Union[np.array, torch.Tensor],
+        done: Union[np.array, torch.Tensor],
+    ):
+        """
+        Append one timestep of agent-environment interaction for every environment to the buffer.
+
+        Args:
+        - obs (torch.Tensor): Current observations, shape (num_envs, *obs_dim).
+        - act (torch.Tensor): Current actions, shape (num_envs, *act_dim).
+        - rew (np.array or torch.Tensor): Current rewards from the environments, shape (num_envs,).
+        - val (np.array or torch.Tensor): Value estimates for the current states, shape (num_envs,).
+        - logp (np.array or torch.Tensor): log probabilities of chosen actions under current policy distribution, shape (num_envs,).
+        - done (np.array or torch.Tensor): Whether each environment's episode ended at this step, shape (num_envs,).
+        """
+        assert self.ptr < self.max_size  # buffer has to have room so you can store
+        self.obs_buf[:, self.ptr] = obs
+        self.act_buf[:, self.ptr] = act
+        self._view("rew_buf")[:, self.ptr] = rew
+        self._view("val_buf")[:, self.ptr] = val
+        self._view("logp_buf")[:, self.ptr] = logp
+        self._view("done_buf")[:, self.ptr] = done
+        self.ptr += 1
+
+    def store_batch(
+        self,
+        obs: torch.Tensor,
+        act: torch.Tensor,
+        rew: Union[np.array, torch.Tensor],
+        val: Union[np.array, torch.Tensor],
+        logp: Union[np.array, torch.Tensor],
+        done: Union[np.array, torch.Tensor],
+    ):
+        """
+        Append a contiguous block of T timesteps for every environment to the buffer in one go.
+
+        Args:
+        - obs (torch.Tensor): Observations, shape (num_envs, T, *obs_dim).
+        - act (torch.Tensor): Actions, shape (num_envs, T, *act_dim).
+        - rew (np.array or torch.Tensor): Rewards from the environments, shape (num_envs, T).
+        - val (np.array or torch.Tensor): Value estimates for the states, shape (num_envs, T).
+        - logp (np.array or torch.Tensor): log probabilities of chosen actions under current policy distribution, shape (num_envs, T).
+        - done (np.array or torch.Tensor): Whether each environment's episode ended at each step, shape (num_envs, T).
+        """
+        block = slice(self.ptr, self.ptr + torch.as_tensor(rew).shape[1])
+        assert block.stop <= self.max_size  # buffer has to have room so you can store
+        self.obs_buf[:, block] = torch.as_tensor(obs).to(self.obs_buf.dtype)
+        self.act_buf[:, block] = torch.as_tensor(act).to(self.act_buf.dtype).reshape(self.act_buf[:, block].shape)
+        self.rew_buf[:, block] = torch.as_tensor(rew, dtype=torch.float32)
+        self.val_buf[:, block] = torch.as_tensor(val, dtype=torch.float32)
+        self.logp_buf[:, block] = torch.as_tensor(logp, dtype=torch.float32)
+        self.done_buf[:, block] = torch.as_tensor(done, dtype=torch.float32)
+        self.ptr = block.stop
+
+    def finish_path(self, last_val: Optional[Union[int, float, np.array, torch.Tensor]] = 0):
+        """
+        Call this at the end of a rollout. Computes GAE-Lambda advantages and rewards-to-go for every environment
+        and every episode stored since the last call, resetting the running sums wherever the done mask is set.
+
+        Args:
+        - last_val (int or float or np.array or torch.Tensor): Value estimates V(s_T) of the states following the last stored
+        step, shape (num_envs,). Ignored for environments whose last stored step is done.
+        """
+        path_slice = slice(self.path_start_idx, self.ptr)
+        self.adv_buf[:, path_slice], self.ret_buf[:, path_slice] = utils.calc_gae(
+            self.rew_buf[:, path_slice],
+            self.val_buf[:, path_slice],
+            torch.as_tensor(last_val, dtype=torch.float32),
+            self.gamma,
+            self.lam,
+            self.done_buf[:, path_slice]
+        )
+
+        self.path_start_idx = self.ptr
+
+    def finish_paths(self, ends: list, last_vals: list):
+        """
+        Finish trajectories which were stored without done masks, given where each environment's trajectories end.
+        The step before each inner end is marked as done, with its bootstrap value folded into the stored reward,
+        and then `finish_path` runs over the whole rollout.
+
+        Args:
+        - ends (list): For each environment, the buffer indices just past the last step of each of its trajectories,
+        in increasing order. The last one must be the current write position.
+        - last_vals (list): For each environment, `last_val` for each of its trajectories; 0 for ones which ended in
+        a terminal state, otherwise V(s_T).
+        """
+        assert len(ends) == len(last_vals) == self.num_envs
+        final_vals = torch.zeros(self.num_envs)
+        for env, (env_ends, env_vals) in enumerate(zip(ends, last_vals)):
+            env_ends = np.asarray(env_ends, dtype=np.int64)
+            env_vals = torch.as_tensor(env_vals, dtype=torch.float32).reshape(len(env_ends))
+            assert env_ends[-1] == self.ptr, "the last trajectory has to end at the write position"
+            inner_ends = torch.as_tensor(env_ends[:-1] - 1)
+            self.done_buf[env, inner_ends] = 1.
+            self.rew_buf[env, inner_ends] += self.gamma * env_vals[:-1]
+            final_vals[env] = env_vals[-1]
+        self.finish_path(final_vals)
+
+    def get(self):
+        """
+        Call this at the end of an epoch to get all of the data from the buffer, flattened to
+        `(num_envs * size, ...)` with each environment's timesteps kept contiguous, and with advantages normalized
+        (shifted to have mean zero and std one). Also, resets some pointers in the buffer.
+
+        Returns:
+        - obs_buf (torch.Tensor): Buffer of observations collected.
+        - act_buf (torch.Tensor): Buffer of actions taken.
+        - adv_buf (torch.Tensor): Advantage calculations.
+        - ret_buf (torch.Tensor): Buffer of earned returns.
+        - logp_buf (torch.Tensor): Buffer of log probabilities of selected actions.
+        """
+        assert self.ptr == self.max_size  # buffer has to be full before you can get
+        self.ptr, self.path_start_idx = 0, 0
+        # the line implement the advantage normalization trick
+        adv_mean, adv_std = self.adv_buf.mean(), self.adv_buf.std(unbiased=False)
+        self.adv_buf = (self.adv_buf - adv_mean) / (adv_std + 1e-8)
+        n = self.num_envs * self.max_size
+        return [
+            self._decode(self.obs_buf.reshape(n, *self.obs_buf.shape[2:]), self.obs_scale),
+            self._decode(self.act_buf.reshape(n, *self.act_buf.shape[2:])),
+            self.adv_buf.reshape(n),
+            self.ret_buf.reshape(n),
+            self.logp_buf.reshape(n)
+        ]
+
+# Cell
+class SharedPGBuffer(PGBuffer):
+    """
+    A `PGBuffer` whose storage lives in shared memory, for collecting rollouts in several processes at once.
+
+    The buffer is split into one disjoint slice per worker. `worker_buffer` returns a worker's slice, with the
+    `store`, `store_batch`, `finish_path` and `finish_paths` methods of a `PGBuffer`, which can be sent to a worker process (e.g. through `torch.multiprocessing`) without copying its
+    arrays. The worker stores and finishes its own paths in place, and `get` in the learner process then returns
+    the full batch straight from shared memory.
 
     Args:
     - obs_dim (tuple or int): Dimensionality of input feature space.
     - act_dim (tuple or int): Dimensionality of action space.
-    - size (int): buffer size.
+    - num_workers (int): Number of rollout workers.
+    - worker_size (int): Number of timesteps stored per worker. Total capacity is num_workers * worker_size.
+    - gamma (float): reward discount factor.
+    - lam (float): Lambda parameter for GAE-Lambda advantage estimation
+    - **kwargs: Storage options passed on to `PGBuffer`, e.g. `obs_dtype`.
+    """
+    def __init__(
+        self,
+        obs_dim: Union[tuple, int],
+        act_dim: Union[tuple, int],
+        num_workers: int,
+        worker_size: int,
+        gamma: Optional[float] = 0.99,
+        lam: Optional[float] = 0.95,
+        **kwargs,
+    ):
+        super().__init__(obs_dim, act_dim, num_workers * worker_size, gamma, lam, **kwargs)
+        for name in self._array_names:
+            getattr(self, name).share_memory_()
+        self.num_workers, self.worker_size = num_workers, worker_size
+        # (ptr, path_start_idx) of each worker's slice
+        self.progress = torch.zeros((num_workers, 2), dtype=torch.int64).share_memory_()
+
+    _array_names = ("obs_buf", "act_buf", "adv_buf", "rew_buf", "ret_buf", "val_buf", "logp_buf")
+
+    def worker_buffer(self, worker_id: int):
+        """
+        Get the slice of the buffer owned by one worker.
+
+        Args:
+        - worker_id (int): Index of the worker.
+
+        Returns:
+        - buffer (PGBuffer-like): A buffer of size `worker_size` backed by the worker's slice of shared memory, which
+        can be stored into and finished like a `PGBuffer`. Its pointers are shared too, so the learner knows when the
+        slice is full and finished. Getting the data is left to `SharedPGBuffer.get` in the learner.
+        """
+        return _SharedPGBufferSlice(self, worker_id)
+
+    def get(self):
+        """
+        Call this in the learner once every worker has filled its slice and finished its paths. Returns the full batch
+        from shared memory, with normalized advantages, and resets every worker's pointers.
+
+        Returns:
+        - obs_buf (torch.Tensor): Buffer of observations collected.
+        - act_buf (torch.Tensor): Buffer of actions taken.
+        - adv_buf (torch.Tensor): Advantage calculations.
+        - ret_buf (torch.Tensor): Buffer of earned returns.
+        - logp_buf (torch.Tensor): Buffer of log probabilities of selected actions.
+        """
+        assert (self.progress[:, 1] == self.worker_size).all()  # every worker has to fill and finish its slice
+        self.progress.zero_()
+        # normalize into a new tensor; the shared advantage buffer has to stay in place for the workers
+        adv_mean, adv_std = self.adv_buf.mean(), self.adv_buf.std(unbiased=False)
+        return [
+            self._decode(self.obs_buf, self.obs_scale),
+            self._decode(self.act_buf),
+            (self.adv_buf - adv_mean) / (adv_std + 1e-8),
+            self.ret_buf,
+            self.logp_buf
+        ]
+
+    def _set_state(self, meta: dict, arrays: dict):
+        super()._set_state(meta, arrays)
+        # loaded arrays are private to this process, move them back to shared memory so worker slices write through
+        for name in self._array_names:
+            getattr(self, name).share_memory_()
+        self.progress.share_memory_()
+
+
+class _SharedPGBufferSlice:
+    """
+    One worker's slice of a `SharedPGBuffer`. Its arrays are views into the shared arrays, and its `ptr` and
+    `path_start_idx` are kept in the shared `progress` tensor.
+
+    Only the write side of `PGBuffer` is borrowed: the data is read out of the whole `SharedPGBuffer` instead.
+    """
+    store = PGBuffer.store
+    store_batch = PGBuffer.store_batch
+    finish_path = PGBuffer.finish_path
+    finish_paths = PGBuffer.finish_paths
+    _view = PGBuffer._view
+
+    def __init__(self, shared: SharedPGBuffer, worker_id: int):
+        block = slice(worker_id * shared.worker_size, (worker_id + 1) * shared.worker_size)
+        for name in shared._array_names:
+            setattr(self, name, getattr(shared, name)[block])
+        self.gamma, self.lam = shared.gamma, shared.lam
+        self.obs_scale = shared.obs_scale
+        self.max_size = shared.worker_size
+        self._progress = shared.progress[worker_id]
+
+    @property
+    def ptr(self):
+        return int(self._progress[0])
+
+    @ptr.setter
+    def ptr(self, value: int):
+        self._progress[0] = value
+
+    @property
+    def path_start_idx(self):
+        return int(self._progress[1])
+
+    @path_start_idx.setter
+    def path_start_idx(self, value: int):
+        self._progress[1] = value
+
+# Cell
+
+class _ReplayBufferBase(PGBuffer):
+    """
+    Storage, episode tracking and uniform sampling shared by `ReplayBuffer` and `ConcurrentReplayBuffer`. See
+    `ReplayBuffer` for the arguments.
     """
 
     def __init__(
-        self, obs_dim: Union[tuple, int], act_dim: Union[tuple, int], size: int
+        self,
+        obs_dim: Union[tuple, int],
+        act_dim: Union[tuple, int],
+        size: int,
+        storage_dir: Optional[str] = None,
+        dedup_obs: Optional[bool] = False,
+        obs_dtype: Optional[torch.dtype] = torch.float32,
+        act_dtype: Optional[torch.dtype] = torch.float32,
+        obs_scale: Optional[float] = 1.,
     ):
-        self.obs1_buf = torch.zeros(self._combined_shape(size, obs_dim), dtype=torch.float32)
-        self.obs2_buf = torch.zeros(self._combined_shape(size, obs_dim), dtype=torch.float32)
-        self.act_buf = torch.zeros(self._combined_shape(size, act_dim), dtype=torch.float32)
-        self.rew_buf = np.zeros(size, dtype=np.float32)
-        self.done_buf = np.zeros(size, dtype=np.float32)
+        self.storage_dir, self._memmaps = storage_dir, []
+        self.dedup_obs = dedup_obs
+        self.obs_scale = obs_scale
+        obs_np_dtype = torch.empty(0, dtype=obs_dtype).numpy().dtype
+        act_np_dtype = torch.empty(0, dtype=act_dtype).numpy().dtype
         self.ptr, self.size, self.max_size = 0, 0, size
+        self.num_episodes = 0
+        if storage_dir is not None:
+            os.makedirs(storage_dir, exist_ok=True)
+            meta_path = os.path.join(storage_dir, "meta.json")
+            if os.path.exists(meta_path):
+                with open(meta_path) as f:
+                    meta = json.load(f)
+                assert meta["max_size"] == size, f"{storage_dir} holds a buffer of size {meta['max_size']}, not {size}"
+                # directories flushed before episode tracking have no episode count
+                self.ptr, self.size, self.num_episodes = meta["ptr"], meta["size"], meta.get("num_episodes", 0)
+
+        self.obs1_buf = torch.from_numpy(self._alloc("obs1_buf", self._combined_shape(size, obs_dim), obs_np_dtype))
+        if dedup_obs:
+            # next observations which are not stored in the following slot, keyed by slot
+            self.obs2_buf = None
+            self.next_obs_cached = np.zeros(size, dtype=bool)
+            self._next_obs_cache = {}
+            cache_path = None if storage_dir is None else os.path.join(storage_dir, "next_obs_cache.npz")
+            if cache_path is not None and os.path.exists(cache_path):
+                cache = np.load(cache_path)
+                for idx, next_obs in zip(cache["idxs"], cache["next_obs"]):
+                    self._next_obs_cache[int(idx)] = torch.from_numpy(next_obs)
+                self.next_obs_cached[cache["idxs"]] = True
+        else:
+            self.obs2_buf = torch.from_numpy(self._alloc("obs2_buf", self._combined_shape(size, obs_dim), obs_np_dtype))
+        self.act_buf = torch.from_numpy(self._alloc("act_buf", self._combined_shape(size, act_dim), act_np_dtype))
+        self.rew_buf = torch.from_numpy(self._alloc("rew_buf", self._combined_shape(size)))
+        self.done_buf = torch.from_numpy(self._alloc("done_buf", self._combined_shape(size)))
+        self.episode_buf = torch.from_numpy(self._alloc("episode_buf", self._combined_shape(size), np.int64))
+        # storage-dtype staging tensors for sampling compact data into float32 batch tensors, keyed by name
+        self._staging = {}
+
+    def _alloc(self, name: str, shape: tuple, dtype: Optional[np.dtype] = np.float32):
+        """
+        Allocate a zeroed buffer array, or a memory-mapped .npy file in `storage_dir` if one was given.
+
+        Existing files are re-opened in place rather than overwritten.
+
+        Args:
+        - name (str): Name of the array, used as the file name.
+        - shape (tuple): Shape of the array.
+        - dtype (np.dtype): Data type of the array.
+
+        Returns:
+        - arr (np.array or np.memmap): The allocated array.
+        """
+        if self.storage_dir is None:
+            return np.zeros(shape, dtype=dtype)
+        path = os.path.join(self.storage_dir, f"{name}.npy")
+        if os.path.exists(path):
+            arr = np.load(path, mmap_mode="r+")
+            assert arr.shape == shape and arr.dtype == dtype, f"{path} does not match the buffer layout"
+        else:
+            arr = np.lib.format.open_memmap(path, mode="w+", dtype=dtype, shape=shape)
+        self._memmaps.append(arr)
+        return arr
+
+    def flush(self):
+        """
+        Flush memory-mapped arrays to disk and record the buffer pointers, so the buffer can be re-opened after a restart.
+        Does nothing for an in-memory buffer.
+        """
+        if self.storage_dir is None:
+            return
+        for arr in self._memmaps:
+            arr.flush()
+        if self.dedup_obs:
+            idxs, next_obs = self._next_obs_cache_arrays()
+            np.savez(os.path.join(self.storage_dir, "next_obs_cache.npz"), idxs=idxs, next_obs=next_obs)
+        with open(os.path.join(self.storage_dir, "meta.json"), "w") as f:
+            json.dump({"ptr": self.ptr, "size": self.size, "max_size": self.max_size, "num_episodes": self.num_episodes}, f)
+
+    def _next_obs_cache_arrays(self):
+        """
+        Stack the `dedup_obs` next observation cache into arrays for saving.
+
+        Returns:
+        - idxs (np.array): Slots with a cached next observation.
+        - next_obs (np.array): The cached next observations.
+        """
+        idxs = np.array(sorted(self._next_obs_cache), dtype=np.int64)
+        if len(idxs) == 0:
+            return idxs, np.zeros((0, *self.obs1_buf.shape[1:]), dtype=self.obs1_buf.numpy().dtype)
+        return idxs, np.stack([self._next_obs_cache[i].numpy() for i in idxs])
+
+    def _get_state(self):
+        meta, arrays = super()._get_state()
+        if self.dedup_obs:
+            arrays["next_obs_cache_idxs"], arrays["next_obs_cache"] = self._next_obs_cache_arrays()
+        return meta, arrays
+
+    def _set_state(self, meta: dict, arrays: dict):
+        # a loaded buffer is backed by the snapshot's copy-on-write mappings, not by its old storage_dir
+        meta["storage_dir"] = None
+        self._memmaps, self._staging = [], {}
+        if meta["dedup_obs"]:
+            idxs, next_obs = arrays.pop("next_obs_cache_idxs"), arrays.pop("next_obs_cache")
+            self._next_obs_cache = {int(i): torch.from_numpy(o) for i, o in zip(idxs, next_obs)}
+        super()._set_state(meta, arrays)
 
     def store(
         self,
@@ -190,6 +806,7 @@ class ReplayBuffer(PGBuffer):
         rew: Union[float, int],
         next_obs: torch.Tensor,
         done: bool,
+        new_episode: Optional[bool] = None,
     ):
         """
         Append one timestep of agent-environment interaction to the buffer.
@@ -200,32 +817,224 @@ class ReplayBuffer(PGBuffer):
         - rew (float or int): Current reward
         - next_obs (torch.Tensor): Observations from next environment step.
         - done (bool): Whether the episode has reached a terminal state.
+        - new_episode (bool): Whether `obs` starts a new episode. If None, this is worked out by comparing `obs` with
+        the previous transition's next observation. Interaction loops know when they reset the env and can pass it to
+        skip the comparison.
         """
         self.obs1_buf[self.ptr] = obs
-        self.obs2_buf[self.ptr] = next_obs
+        if new_episode is None:
+            new_episode = self._starts_episode()
+        if new_episode:
+            self.num_episodes += 1
+        self._view("episode_buf")[self.ptr] = self.num_episodes - 1
+        if self.dedup_obs:
+            self._store_next_obs(next_obs, new_episode)
+        else:
+            self.obs2_buf[self.ptr] = next_obs
         self.act_buf[self.ptr] = act
-        self.rew_buf[self.ptr] = rew
-        self.done_buf[self.ptr] = done
+        self._view("rew_buf")[self.ptr] = rew
+        self._view("done_buf")[self.ptr] = done
         self.ptr = (self.ptr + 1) % self.max_size
         self.size = min(self.size + 1, self.max_size)
 
-    def sample_batch(self, batch_size: Optional[int] = 32):
+    def _starts_episode(self):
+        """
+        Check whether the observation just written to the current slot starts a new episode, instead of continuing
+        the episode of the previous transition.
+
+        Returns:
+        - new_episode (bool)
+        """
+        prev = (self.ptr - 1) % self.max_size
+        if self.size == 0 or self._view("done_buf")[prev]:
+            return True
+        # compare with the stored copy of the previous next observation directly, a gather through `_get_next_obs`
+        # costs more than the rest of `store`
+        prev_next_obs = self._next_obs_cache[prev] if self.dedup_obs else self.obs2_buf[prev]
+        return not torch.equal(prev_next_obs, self.obs1_buf[self.ptr])
+
+    def _store_next_obs(self, next_obs: torch.Tensor, new_episode: bool):
+        """
+        Episode-boundary bookkeeping for `dedup_obs` mode. Called after the observation is written to the current slot.
+
+        The next observation of the new transition can't be in the ring yet, so it is cached. The previous transition's
+        cached next observation is dropped if the new transition continues its episode, since it is now stored in
+        this slot.
+        """
+        prev = (self.ptr - 1) % self.max_size
+        if not new_episode and self.next_obs_cached[prev]:
+            del self._next_obs_cache[prev]
+            self.next_obs_cached[prev] = False
+
+        self._next_obs_cache[self.ptr] = torch.as_tensor(next_obs).to(self.obs1_buf.dtype, copy=True)
+        self.next_obs_cached[self.ptr] = True
+
+    def _get_next_obs(self, idxs: np.array):
+        """
+        Gather the next observations of the transitions stored at the input indices.
+
+        Args:
+        - idxs (np.array): Buffer indices to gather.
+
+        Returns:
+        - obs2 (torch.Tensor): Next observations.
+        """
+        if not self.dedup_obs:
+            return self.obs2_buf[idxs]
+        obs2 = self.obs1_buf[(idxs + 1) % self.max_size]
+        for i in np.nonzero(self.next_obs_cached[idxs])[0]:
+            obs2[i] = self._next_obs_cache[int(idxs[i])]
+        return obs2
+
+    def sample_batch(self, batch_size: Optional[int] = 32, out: Optional[tuple] = None):
         """
         Sample a batch of agent-environment interaction from the buffer.
 
         Args:
         - batch_size (int): Number of interactions to sample for the batch.
+        - out (tuple of torch.Tensor): Optional batch tensors from `alloc_batch` to sample into. Reusing them across
+        calls avoids allocating new batch tensors for every update.
+
+        Returns:
+        - tuple of batch tensors: (obs, obs2, act, rew, done). These are the `out` tensors if given.
+        """
+        idxs = np.random.randint(0, self.size, size=batch_size)
+        return self._get_batch(idxs, out=out)
+
+    def alloc_batch(self, batch_size: Optional[int] = 32, pin_memory: Optional[bool] = False):
+        """
+        Allocate float32 batch tensors to pass as `out` to `sample_batch`.
+
+        Args:
+        - batch_size (int): Number of interactions in the batch.
+        - pin_memory (bool): Allocate the tensors in page-locked memory, for faster asynchronous copies to the GPU.
+
+        Returns:
+        - tuple of batch tensors: (obs, obs2, act, rew, done)
+        """
+        obs_shape, act_shape = self.obs1_buf.shape[1:], self.act_buf.shape[1:]
+        return tuple(
+            torch.empty((batch_size, *shape), dtype=torch.float32, pin_memory=pin_memory)
+            for shape in (obs_shape, obs_shape, act_shape, (), ())
+        )
+
+    def _get_batch(self, idxs: np.array, out: Optional[tuple] = None):
+        """
+        Gather the transitions stored at the input indices.
+
+        Args:
+        - idxs (np.array): Buffer indices to gather.
+        - out (tuple of torch.Tensor): Optional batch tensors from `alloc_batch` to gather into.
 
         Returns:
         - tuple of batch tensors
         """
+        if out is None:
+            out = self.alloc_batch(len(idxs))
+        assert len(out[0]) == len(idxs), "out tensors do not match the batch size"
+        obs, obs2, act, rew, done = out
+        idxs = torch.as_tensor(idxs)
+
+        self._select("obs", self.obs1_buf, idxs, obs, self.obs_scale)
+        if self.dedup_obs:
+            self._select("obs2", self.obs1_buf, (idxs + 1) % self.max_size, obs2, self.obs_scale)
+            for i in np.nonzero(self.next_obs_cached[idxs.numpy()])[0]:
+                obs2[i] = self._decode(self._next_obs_cache[int(idxs[i])], self.obs_scale)
+        else:
+            self._select("obs2", self.obs2_buf, idxs, obs2, self.obs_scale)
+        self._select("act", self.act_buf, idxs, act)
+        torch.index_select(self.rew_buf, 0, idxs, out=rew)
+        torch.index_select(self.done_buf, 0, idxs, out=done)
+        return out
+
+    def _select(self, name: str, src: torch.Tensor, idxs: torch.Tensor, out: torch.Tensor, scale: Optional[float] = 1.):
+        """
+        Gather rows of a buffer into a float32 output tensor in place, decoding compact storage dtypes on the way.
+
+        Args:
+        - name (str): Name of the staging tensor to use for non-float32 buffers.
+        - src (torch.Tensor): Buffer to gather from.
+        - idxs (torch.Tensor): Buffer indices to gather.
+        - out (torch.Tensor): Output tensor.
+        - scale (float): Factor to multiply the gathered data by.
+        """
+        if src.dtype == out.dtype:
+            torch.index_select(src, 0, idxs, out=out)
+        else:
+            staged = self._staging.get(name)
+            if staged is None or staged.shape != out.shape:
+                staged = self._staging[name] = torch.empty(out.shape, dtype=src.dtype)
+            torch.index_select(src, 0, idxs, out=staged)
+            out.copy_(staged)
+        if scale != 1.:
+            out.mul_(scale)
+
+    def _continues(self, idxs: np.array):
+        """
+        Check whether the transitions at the input indices are followed, in the next slot of the ring, by the next
+        transition of the same episode. This is False at terminal states, at episode cutoffs, and at the write pointer.
+
+        Args:
+        - idxs (np.array): Buffer indices to check.
+
+        Returns:
+        - continues (np.array): Boolean array shaped like `idxs`.
+        """
+        next_idxs = (idxs + 1) % self.max_size
+        same_episode = self.episode_buf[torch.as_tensor(idxs)] == self.episode_buf[torch.as_tensor(next_idxs)]
+        return same_episode.numpy() & (next_idxs != self.ptr)
+
+    def sample_nstep_batch(
+        self,
+        batch_size: Optional[int] = 32,
+        n_step: Optional[int] = 3,
+        gamma: Optional[float] = 0.99,
+    ):
+        """
+        Sample a batch of n-step transitions from the buffer.
+
+        Rewards are summed over up to `n_step` steps, stopping early at the end of an episode or at the newest
+        transition in the buffer. Use the returned per-sample discounts in place of `gamma` in the Bellman backup.
+
+        Args:
+        - batch_size (int): Number of transitions to sample for the batch.
+        - n_step (int): Maximum number of steps to accumulate rewards over.
+        - gamma (float): Reward discount factor.
+
+        Returns:
+        - tuple of batch tensors: (states, n-step next states, actions, n-step discounted rewards, dones, discounts)
+        """
         idxs = np.random.randint(0, self.size, size=batch_size)
+        return self._get_nstep_batch(idxs, n_step, gamma)
+
+    def _get_nstep_batch(self, idxs: np.array, n_step: int, gamma: float):
+        """
+        Gather the n-step transitions starting at the input indices.
+
+        Args:
+        - idxs (np.array): Buffer indices to start from.
+        - n_step (int): Maximum number of steps to accumulate rewards over.
+        - gamma (float): Reward discount factor.
+
+        Returns:
+        - tuple of batch tensors
+        """
+        steps = (idxs[:, None] + np.arange(n_step)) % self.max_size
+        # step k is taken only if every step before it continues the episode
+        valid = np.ones(steps.shape, dtype=bool)
+        if n_step > 1:
+            valid[:, 1:] = np.cumprod(self._continues(steps[:, :-1]), axis=1).astype(bool)
+        num_steps = valid.sum(axis=1)
+        last_idxs = steps[np.arange(len(idxs)), num_steps - 1]
+
+        rew = (self.rew_buf[torch.as_tensor(steps)] * torch.as_tensor(valid) * gamma ** torch.arange(n_step)).sum(dim=1)
         batch = dict(
-            obs=self.obs1_buf[idxs],
-            obs2=self.obs2_buf[idxs],
+            obs=self._decode(self.obs1_buf[idxs], self.obs_scale),
+            obs2=self._decode(self._get_next_obs(last_idxs), self.obs_scale),
             act=self.act_buf[idxs],
-            rew=self.rew_buf[idxs],
-            done=self.done_buf[idxs],
+            rew=rew,
+            done=self.done_buf[torch.as_tensor(last_idxs)],
+            discount=gamma ** num_steps,
         )
         return tuple(torch.as_tensor(v, dtype=torch.float32) for _, v in batch.items())
 
@@ -237,9 +1046,503 @@ class ReplayBuffer(PGBuffer):
         - list of PyTorch Tensors; full contents of the buffer.
         """
         return [
-            torch.as_tensor(self.obs1_buf, dtype=torch.float32),
-            torch.as_tensor(self.obs2_buf, dtype=torch.float32),
+            self._decode(self.obs1_buf, self.obs_scale),
+            self._decode(self._get_next_obs(np.arange(self.max_size)), self.obs_scale),
             torch.as_tensor(self.act_buf, dtype=torch.float32),
-            torch.as_tensor(self.rew_buf, dtype=torch.float32),
-            torch.as_tensor(self.done_buf, dtype=torch.float32)
-        ]
\ No newline at end of file
+            self.rew_buf,
+            self.done_buf
+        ]
+
+
+class ReplayBuffer(_ReplayBufferBase):
+    """
+    A replay buffer for off-policy RL agents.
+
+    This class is borrowed from OpenAI's SpinningUp package: https://spinningup.openai.com/en/latest/
+
+    The buffer also tags every transition with an episode id, so `sample_sequences` can return contiguous segments of
+    episodes for recurrent or sequence models. A new episode starts after a terminal state, or when a stored
+    observation doesn't match the previous transition's next observation (e.g. after a time limit cutoff).
+
+    Args:
+    - obs_dim (tuple or int): Dimensionality of input feature space.
+    - act_dim (tuple or int): Dimensionality of action space.
+    - size (int): buffer size.
+    - storage_dir (str): If given, keep the buffer arrays in memory-mapped files in this directory instead of in RAM, so
+    the buffer can be larger than host memory. If the directory already holds a buffer, it is re-opened with its
+    contents. Call `flush` to persist the pointers.
+    - dedup_obs (bool): If True, store each observation only once. The next observation of a transition is read from
+    the following slot of the ring, and only the next observations that can't be found there (at episode ends, and for
+    the most recent transition) are kept separately. This roughly halves observation memory.
+    - obs_dtype (torch.dtype): Storage type for observations, e.g. torch.uint8 for pixels or torch.float16.
+    Observations are cast back to float32 only when read out of the buffer.
+    - act_dtype (torch.dtype): Storage type for actions.
+    - obs_scale (float): Factor applied to observations when they are read out, e.g. 1 / 255 for uint8 pixels.
+    """
+
+    def sample_sequences(self, batch_size: Optional[int] = 32, seq_len: Optional[int] = 8):
+        """
+        Sample a batch of contiguous segments of episodes, e.g. for training recurrent policies.
+
+        Each segment starts at a uniformly sampled transition and runs for `seq_len` steps, or until its episode ends
+        or the newest transition is reached. Steps past that point are zero-padded and masked out.
+
+        Args:
+        - batch_size (int): Number of segments to sample.
+        - seq_len (int): Length of each segment.
+
+        Returns:
+        - tuple of batch tensors: (obs, obs2, act, rew, done, mask), each shaped (batch_size, seq_len, ...). The mask
+        is 1 for real transitions and 0 for padding.
+        """
+        starts = np.random.randint(0, self.size, size=batch_size)
+        return self._get_sequences(starts, seq_len)
+
+    def _get_sequences(self, starts: np.array, seq_len: int):
+        """
+        Gather the segments of episodes beginning at the input indices.
+
+        Args:
+        - starts (np.array): Buffer indices to start the segments at.
+        - seq_len (int): Length of each segment.
+
+        Returns:
+        - tuple of batch tensors
+        """
+        steps = (starts[:, None] + np.arange(seq_len)) % self.max_size
+        # number of transitions from each start up to and including the newest one
+        num_available = (self.ptr - starts - 1) % self.max_size + 1
+        mask = (self.episode_buf[torch.as_tensor(steps)] == self.episode_buf[torch.as_tensor(starts)][:, None])
+        mask &= torch.as_tensor(np.arange(seq_len) < num_available[:, None])
+        mask = mask.to(torch.float32)
+
+        batch = self._get_batch(steps.ravel())
+        batch = [x.reshape(*steps.shape, *x.shape[1:]) for x in batch]
+        batch = [x * mask.reshape(*mask.shape, *[1] * (x.dim() - 2)) for x in batch]
+        return tuple(batch) + (mask,)
+
+# Cell
+class ConcurrentReplayBuffer(_ReplayBufferBase):
+    """
+    A `ReplayBuffer` which can be written to and sampled from by several threads at once, e.g. an environment
+    collector thread and a learner thread.
+
+    Writers reserve slots under a lock, fill them outside of it, then mark them as committed. Slots which are still
+    being written are never sampled, and a writer which laps a slower one waits for it to commit. Sampling only takes
+    the lock to pick its slots and pin them, then gathers the batch outside of it. A writer which reaches a pinned slot
+    waits until it is unpinned, so slots are never overwritten while being read.
+
+    Transitions from concurrent writers are interleaved, so episodes aren't contiguous in the ring and the buffer has
+    no `sample_sequences`.
+
+    Args:
+    - obs_dim (tuple or int): Dimensionality of input feature space.
+    - act_dim (tuple or int): Dimensionality of action space.
+    - size (int): buffer size.
+    - **kwargs: Storage options passed on to `ReplayBuffer`. `dedup_obs` is not supported, since it relies on
+    transitions being stored in order.
+    """
+    def __init__(
+        self,
+        obs_dim: Union[tuple, int],
+        act_dim: Union[tuple, int],
+        size: int,
+        **kwargs,
+    ):
+        assert not kwargs.get("dedup_obs", False), "dedup_obs is not supported with concurrent writers"
+        super().__init__(obs_dim, act_dim, size, **kwargs)
+        self._lock = threading.Condition()
+        self.writing = np.zeros(size, dtype=bool)
+        self.reading = np.zeros(size, dtype=np.int64)
+        self._num_writing = 0
+
+    def store(
+        self,
+        obs: torch.Tensor,
+        act: Union[float, int, torch.Tensor],
+        rew: Union[float, int],
+        next_obs: torch.Tensor,
+        done: bool,
+        new_episode: Optional[bool] = None,
+    ):
+        """
+        Append one timestep of agent-environment interaction to the buffer.
+
+        Args:
+        - obs (torch.Tensor): Current observations.
+        - act (float or int or torch.Tensor): Current action.
+        - rew (float or int): Current reward
+        - next_obs (torch.Tensor): Observations from next environment step.
+        - done (bool): Whether the episode has reached a terminal state.
+        - new_episode (bool): Unused, this buffer doesn't track episodes. Accepted so that the buffer can stand in for
+        a `ReplayBuffer`.
+        """
+        self.store_many(
+            torch.as_tensor(obs)[None],
+            torch.as_tensor(act)[None],
+            torch.as_tensor(rew)[None],
+            torch.as_tensor(next_obs)[None],
+            torch.as_tensor(done)[None],
+        )
+
+    def store_many(
+        self,
+        obs: torch.Tensor,
+        act: torch.Tensor,
+        rew: Union[np.array, torch.Tensor],
+        next_obs: torch.Tensor,
+        done: Union[np.array, torch.Tensor],
+    ):
+        """
+        Append a batch of timesteps of agent-environment interaction to the buffer, taking the lock only twice.
+
+        Args:
+        - obs (torch.Tensor): Current observations, shape (N, *obs_dim).
+        - act (torch.Tensor): Current actions, shape (N, *act_dim).
+        - rew (np.array or torch.Tensor): Current rewards, shape (N,).
+        - next_obs (torch.Tensor): Observations from next environment step, shape (N, *obs_dim).
+        - done (np.array or torch.Tensor): Whether each episode has reached a terminal state, shape (N,).
+        """
+        n = len(obs)
+        idxs = self._reserve(n)
+        self.obs1_buf[idxs] = torch.as_tensor(obs).to(self.obs1_buf.dtype)
+        self.obs2_buf[idxs] = torch.as_tensor(next_obs).to(self.obs2_buf.dtype)
+        self.act_buf[idxs] = torch.as_tensor(act).to(self.act_buf.dtype).reshape(n, *self.act_buf.shape[1:])
+        self.rew_buf[idxs] = torch.as_tensor(rew).to(torch.float32)
+        self.done_buf[idxs] = torch.as_tensor(done).to(torch.float32)
+        self._commit(idxs)
+
+    def _reserve(self, n: int):
+        """
+        Reserve the next `n` slots of the ring for writing, waiting until none of them are still being written or
+        pinned by a reader.
+
+        Args:
+        - n (int): Number of slots to reserve.
+
+        Returns:
+        - idxs (torch.Tensor): Reserved buffer indices.
+        """
+        assert n <= self.max_size, "can't write more transitions at once than the buffer holds"
+        with self._lock:
+            self._lock.wait_for(lambda: self._free((self.ptr + np.arange(n)) % self.max_size))
+            idxs = (self.ptr + np.arange(n)) % self.max_size
+            self.writing[idxs] = True
+            self._num_writing += n
+            self.ptr = (self.ptr + n) % self.max_size
+            self.size = min(self.size + n, self.max_size)
+        return torch.as_tensor(idxs)
+
+    def _free(self, idxs: np.array):
+        """
+        Whether none of the input slots are being written or read. Call with the lock held.
+        """
+        return not (self.writing[idxs].any() or self.reading[idxs].any())
+
+    def _commit(self, idxs: torch.Tensor):
+        """
+        Mark reserved slots as fully written, making them available for sampling.
+
+        Args:
+        - idxs (torch.Tensor): Buffer indices returned by `_reserve`.
+        """
+        with self._lock:
+            self.writing[idxs.numpy()] = False
+            self._num_writing -= len(idxs)
+            self._lock.notify_all()
+
+    def _sample_idxs(self, batch_size: int):
+        """
+        Draw uniform buffer indices, redrawing any which point at slots that are still being written.
+        Call with the lock held.
+        """
+        assert self.size > self._num_writing, "no committed transitions to sample from"
+        idxs = np.random.randint(0, self.size, size=batch_size)
+        writing = self.writing[idxs]
+        while writing.any():
+            idxs[writing] = np.random.randint(0, self.size, size=writing.sum())
+            writing = self.writing[idxs]
+        return idxs
+
+    def _pin(self, batch_size: int, span: Optional[int] = 1):
+        """
+        Draw start indices for a batch and pin the `span` slots starting at each of them, so that writers leave them
+        alone until `_unpin` is called.
+
+        Args:
+        - batch_size (int): Number of start indices to draw.
+        - span (int): Number of consecutive slots read from each start index.
+
+        Returns:
+        - idxs (np.array): Start indices.
+        - pinned (np.array): Pinned slots, to pass to `_unpin`.
+        """
+        with self._lock:
+            idxs = self._sample_idxs(batch_size)
+            pinned = ((idxs[:, None] + np.arange(span)) % self.max_size).ravel()
+            np.add.at(self.reading, pinned, 1)
+        return idxs, pinned
+
+    def _unpin(self, pinned: np.array):
+        """
+        Release slots pinned by `_pin` and wake up writers waiting on them.
+
+        Args:
+        - pinned (np.array): Slots returned by `_pin`.
+        """
+        with self._lock:
+            np.subtract.at(self.reading, pinned, 1)
+            self._lock.notify_all()
+
+    def _continues(self, idxs: np.array):
+        """
+        Like `ReplayBuffer._continues`, but without episode ids: episodes cut off without a terminal state show up as
+        a mismatch between the next observation and the next slot's observation. N-step accumulation also stops in
+        front of slots still being written.
+
+        Runs without the lock, on slots pinned by `_pin`. Writers can't reserve pinned slots, so the write pointer
+        can't move past them, and a pinned slot which is no longer marked as being written holds its final data. The
+        flags are therefore read before the data.
+        """
+        next_idxs = (idxs + 1) % self.max_size
+        continues = ~self.writing[next_idxs] & (next_idxs != self.ptr)
+        continues &= (self.done_buf[torch.as_tensor(idxs)] == 0).numpy()
+        same = self.obs2_buf[idxs.ravel()] == self.obs1_buf[next_idxs.ravel()]
+        return continues & same.reshape(idxs.size, -1).all(dim=1).numpy().reshape(idxs.shape)
+
+    def sample_batch(self, batch_size: Optional[int] = 32, out: Optional[tuple] = None):
+        """
+        Sample a batch of committed agent-environment interaction from the buffer.
+
+        Args:
+        - batch_size (int): Number of interactions to sample for the batch.
+        - out (tuple of torch.Tensor): Optional batch tensors from `alloc_batch` to sample into.
+
+        Returns:
+        - tuple of batch tensors: (obs, obs2, act, rew, done)
+        """
+        idxs, pinned = self._pin(batch_size)
+        try:
+            return self._get_batch(idxs, out=out)
+        finally:
+            self._unpin(pinned)
+
+    def sample_nstep_batch(
+        self,
+        batch_size: Optional[int] = 32,
+        n_step: Optional[int] = 3,
+        gamma: Optional[float] = 0.99,
+    ):
+        """
+        Sample a batch of committed n-step transitions from the buffer. See `ReplayBuffer.sample_nstep_batch`.
+
+        Args:
+        - batch_size (int): Number of transitions to sample for the batch.
+        - n_step (int): Maximum number of steps to accumulate rewards over.
+        - gamma (float): Reward discount factor.
+
+        Returns:
+        - tuple of batch tensors: (states, n-step next states, actions, n-step discounted rewards, dones, discounts)
+        """
+        # the n steps and the slot after them, whose observation `_continues` compares against
+        idxs, pinned = self._pin(batch_size, span=n_step + 1)
+        try:
+            return self._get_nstep_batch(idxs, n_step, gamma)
+        finally:
+            self._unpin(pinned)
+
+    def save(self, path: str):
+        """
+        Save a snapshot of the buffer to a directory, after waiting for in-flight writes to commit. See `PGBuffer.save`.
+
+        Args:
+        - path (str): Directory to save to. Created if it doesn't exist.
+        """
+        with self._lock:
+            self._lock.wait_for(lambda: self._num_writing == 0)
+            super().save(path)
+
+    def _set_state(self, meta: dict, arrays: dict):
+        self._lock = threading.Condition()
+        super()._set_state(meta, arrays)
+        # readers of the saved buffer are gone
+        self.reading = np.zeros(self.max_size, dtype=np.int64)
+
+    def flush(self):
+        """
+        Flush memory-mapped arrays to disk and record the buffer pointers. See `ReplayBuffer.flush`.
+        """
+        with self._lock:
+            super().flush()
+
+# Cell
+class SumTree:
+    """
+    A binary sum-tree over a fixed number of leaves, stored in a flat NumPy array.
+
+    The root (index 1) holds the sum of all leaves and every internal node holds the sum of its two children.
+    Both `update` and `find` operate on a whole batch of leaves at once and walk the tree one level at a time,
+    so they cost O(log n) vectorized NumPy operations regardless of batch size.
+
+    Args:
+    - capacity (int): Number of leaves.
+    """
+    def __init__(self, capacity: int):
+        self.capacity = capacity
+        self.num_leaves = 1
+        while self.num_leaves < capacity:
+            self.num_leaves *= 2
+        self.tree = np.zeros(2 * self.num_leaves, dtype=np.float64)
+
+    def total(self) -> float:
+        """Return the sum over all leaves."""
+        return self.tree[1]
+
+    def __getitem__(self, idxs: Union[int, np.array]):
+        return self.tree[np.asarray(idxs) + self.num_leaves]
+
+    def update(self, idxs: Union[int, np.array], values: Union[float, np.array]):
+        """
+        Set the values of a batch of leaves and refresh the sums of their ancestors.
+
+        Args:
+        - idxs (int or np.array): Leaf indices to set.
+        - values (float or np.array): New leaf values.
+        """
+        nodes = np.atleast_1d(np.asarray(idxs, dtype=np.int64)) + self.num_leaves
+        self.tree[nodes] = values
+        while nodes[0] > 1:
+            nodes = np.unique(nodes // 2)
+            self.tree[nodes] = self.tree[2 * nodes] + self.tree[2 * nodes + 1]
+
+    def find(self, prefixsums: np.array) -> np.array:
+        """
+        For each input prefix sum, find the leaf where the running sum of leaves first exceeds it.
+
+        Sampling uniform prefix sums in [0, total) with this method samples leaves in proportion to their values.
+
+        Args:
+        - prefixsums (np.array): Prefix sums to search for.
+
+        Returns:
+        - idxs (np.array): Leaf indices.
+        """
+        prefixsums = np.array(prefixsums, dtype=np.float64)
+        nodes = np.ones(len(prefixsums), dtype=np.int64)
+        while nodes[0] < self.num_leaves:
+            left = 2 * nodes
+            left_sums = self.tree[left]
+            go_right = prefixsums >= left_sums
+            prefixsums -= left_sums * go_right
+            nodes = left + go_right
+        return np.minimum(nodes - self.num_leaves, self.capacity - 1)
+
+# Cell
+class PrioritizedReplayBuffer(ReplayBuffer):
+    """
+    A replay buffer which samples transitions in proportion to their priority. See the paper: https://arxiv.org/abs/1511.05952
+
+    Priorities are kept in a `SumTree`, so sampling a batch and updating its priorities both cost O(log n).
+    New transitions are stored with the highest priority seen so far, so they are sampled at least once.
+
+    Args:
+    - obs_dim (tuple or int): Dimensionality of input feature space.
+    - act_dim (tuple or int): Dimensionality of action space.
+    - size (int): buffer size.
+    - alpha (float): How strongly to prioritize. 0 is uniform sampling.
+    - beta (float): Importance-sampling correction exponent. 1 fully corrects for the non-uniform sampling.
+    - eps (float): Small constant added to priorities so no transition has zero probability of being sampled.
+    - **kwargs: Storage options passed on to `ReplayBuffer`, e.g. `storage_dir` or `obs_dtype`. Priorities are not
+    memory-mapped; transitions in a re-opened buffer start out with equal priority.
+    """
+    def __init__(
+        self,
+        obs_dim: Union[tuple, int],
+        act_dim: Union[tuple, int],
+        size: int,
+        alpha: Optional[float] = 0.6,
+        beta: Optional[float] = 0.4,
+        eps: Optional[float] = 1e-6,
+        **kwargs,
+    ):
+        super().__init__(obs_dim, act_dim, size, **kwargs)
+        self.alpha, self.beta, self.eps = alpha, beta, eps
+        self.tree = SumTree(size)
+        self.max_priority = 1.
+        if self.size > 0:
+            self.tree.update(np.arange(self.size), self.max_priority ** self.alpha)
+
+    def store(
+        self,
+        obs: torch.Tensor,
+        act: Union[float, int, torch.Tensor],
+        rew: Union[float, int],
+        next_obs: torch.Tensor,
+        done: bool,
+        new_episode: Optional[bool] = None,
+    ):
+        """
+        Append one timestep of agent-environment interaction to the buffer, with maximal priority.
+
+        Args:
+        - obs (torch.Tensor): Current observations.
+        - act (float or int or torch.Tensor): Current action.
+        - rew (float or int): Current reward
+        - next_obs (torch.Tensor): Observations from next environment step.
+        - done (bool): Whether the episode has reached a terminal state.
+        - new_episode (bool): Whether `obs` starts a new episode. See `ReplayBuffer.store`.
+        """
+        idx = self.ptr
+        super().store(obs, act, rew, next_obs, done, new_episode)
+        self.tree.update(idx, self.max_priority ** self.alpha)
+
+    def sample_batch(self, batch_size: Optional[int] = 32, beta: Optional[float] = None, out: Optional[tuple] = None):
+        """
+        Sample a batch of agent-environment interaction from the buffer in proportion to priority.
+
+        The batch is stratified: the total priority is split into `batch_size` equal segments and one transition
+        is drawn from each.
+
+        Args:
+        - batch_size (int): Number of interactions to sample for the batch.
+        - beta (float): Importance-sampling exponent to use for this batch. Defaults to the buffer's beta.
+        - out (tuple of torch.Tensor): Optional batch tensors from `alloc_batch` to sample the transitions into.
+
+        Returns:
+        - tuple of batch tensors: (obs, obs2, act, rew, done, weights, idxs). The importance-sampling weights are
+        normalized so the largest in the batch is 1. Pass the indices back to `update_priorities`.
+        """
+        beta = self.beta if beta is None else beta
+        total = self.tree.total()
+        segments = (np.arange(batch_size) + np.random.uniform(size=batch_size)) / batch_size
+        idxs = self.tree.find(segments * total)
+
+        probs = self.tree[idxs] / total
+        weights = (self.size * probs) ** (-beta)
+        weights /= weights.max()
+        return self._get_batch(idxs, out=out) + (
+            torch.as_tensor(weights, dtype=torch.float32),
+            torch.as_tensor(idxs, dtype=torch.int64)
+        )
+
+    def _get_state(self):
+        meta, arrays = super()._get_state()
+        arrays["priority_tree"] = self.tree.tree
+        return meta, arrays
+
+    def _set_state(self, meta: dict, arrays: dict):
+        self.tree = SumTree(meta["max_size"])
+        self.tree.tree = arrays.pop("priority_tree")
+        super()._set_state(meta, arrays)
+
+    def update_priorities(self, idxs: Union[np.array, torch.Tensor], priorities: Union[np.array, torch.Tensor]):
+        """
+        Update the priorities of sampled transitions, usually with their absolute TD errors.
+
+        Args:
+        - idxs (np.array or torch.Tensor): Buffer indices returned by `sample_batch`.
+        - priorities (np.array or torch.Tensor): New priorities for those transitions.
+        """
+        priorities = np.abs(np.asarray(priorities, dtype=np.float64)) + self.eps
+        self.tree.update(np.asarray(idxs), priorities ** self.alpha)
+        self.max_priority = max(self.max_priority, priorities.max())
\ No newline at end of file
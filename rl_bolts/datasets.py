@@ -1,6 +1,6 @@
 # AUTOGENERATED! DO NOT EDIT! File to edit: nbs/01_datasets.ipynb (unless otherwise specified).
 
-__all__ = ['PolicyGradientRLDataset', 'QPolicyGradientRLDataset']
+__all__ = ['PolicyGradientRLDataset', 'QPolicyGradientRLDataset', 'MinibatchRLDataset']
 
 # Cell
 import torch
@@ -60,4 +60,35 @@ class QPolicyGradientRLDataset(Dataset):
         act = self.data[2][idx]
         rew = self.data[3][idx]
         done = self.data[4][idx]
-        return obs, obs2, act, rew, done
\ No newline at end of file
+        return obs, obs2, act, rew, done
+
+# Cell
+class MinibatchRLDataset(IterableDataset):
+    """
+    An iterable dataset yielding whole minibatches from a buffer's `minibatches` generator.
+
+    Batches are already collated, so use it with `DataLoader(dataset, batch_size=None)` and no worker processes.
+
+    Args:
+    - buffer (rl_bolts.buffers.PGBuffer-like): Buffer whose `minibatches` method generates the batches.
+    - data (list of torch.Tensor): Output of the buffer's `get` to iterate over.
+    - batch_size (int): Number of interactions per minibatch.
+    - epochs (int): Number of passes over the data per iteration of the dataset.
+    - shuffle (bool): Whether to shuffle the data each epoch.
+    """
+    def __init__(
+        self,
+        buffer,
+        data,
+        batch_size: int = 64,
+        epochs: int = 1,
+        shuffle: bool = True
+    ):
+        self.buffer = buffer
+        self.data = data
+        self.batch_size = batch_size
+        self.epochs = epochs
+        self.shuffle = shuffle
+
+    def __iter__(self):
+        return self.buffer.minibatches(self.batch_size, self.epochs, self.shuffle, data=self.data)
\ No newline at end of file
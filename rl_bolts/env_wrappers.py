@@ -1,11 +1,15 @@
 # AUTOGENERATED! DO NOT EDIT! File to edit: nbs/05_env_wrappers.ipynb (unless otherwise specified).
 
-__all__ = ['ToTorchWrapper', 'StateNormalizeWrapper', 'RewardScalerWrapper', 'BestPracticesWrapper']
+__all__ = ['ToTorchWrapper', 'RunningMeanStd', 'StateNormalizeWrapper', 'RewardScalerWrapper', 'BestPracticesWrapper',
+           'VecToTorchWrapper', 'VecStateNormalizeWrapper', 'VecRewardScalerWrapper', 'LazyFrames', 'FrameStackWrapper',
+           'ActionRepeatWrapper']
 
 # Cell
 import gym
 import numpy as np
 import torch
+import collections
+import warnings
 from typing import Optional, Union
 
 # Cell
@@ -14,14 +18,52 @@ class ToTorchWrapper(gym.Wrapper):
     Environment wrapper for converting actions from torch.Tensors to np.array and converting observations from np.array to
     torch.Tensors.
 
+    The action conversion is picked once, from the action space, when the wrapper is created. float32 observations are
+    shared with the environment's arrays rather than copied. With `preallocate`, observations are instead written into
+    one float32 Tensor which is reused at every step.
+
+    In both cases a returned observation may be overwritten by a later `step` or `reset`: always with `preallocate`,
+    and without it if the environment reuses its observation array. The interaction loops in `rl_bolts.loops` copy the
+    observations they keep, so they are safe with either setting. Code which keeps observations across steps itself
+    should `clone` them.
+
     Args:
     - env (gym.Env): Environment to wrap. Should be a subclass of gym.Env and follow the OpenAI Gym API.
+    - preallocate (bool): Whether to write observations into a reused, preallocated float32 Tensor.
     """
-    def __init__(self, env: gym.Env):
+    def __init__(self, env: gym.Env, preallocate: Optional[bool] = False):
         super().__init__(env)
 
         self.env = env
 
+        if isinstance(self.action_space, gym.spaces.Discrete):
+            self._action_map = int
+        else:
+            self._action_map = lambda action: action.numpy()
+
+        self._obs_buf = None
+        if preallocate:
+            self._obs_buf = torch.zeros(self.observation_space.shape, dtype=torch.float32)
+            self._obs_buf_np = self._obs_buf.numpy()
+
+    def obs2torch(self, obs: np.array):
+        """
+        Convert an observation from the environment to a float32 torch.Tensor.
+
+        Args:
+        - obs (np.array): The observation to convert.
+
+        Returns:
+        - tensor_obs (torch.Tensor): The observation as a PyTorch Tensor.
+        """
+        if self._obs_buf is not None:
+            np.copyto(self._obs_buf_np, obs, casting="unsafe")
+            return self._obs_buf
+        if isinstance(obs, np.ndarray) and obs.dtype == np.float32:
+            return torch.from_numpy(obs)
+        # np.asarray also materializes array-likes such as LazyFrames
+        return torch.as_tensor(np.asarray(obs), dtype=torch.float32)
+
     def reset(self, *args, **kwargs):
         """
         Reset the environment.
@@ -30,8 +72,7 @@ class ToTorchWrapper(gym.Wrapper):
         - tensor_obs (torch.Tensor): output of reset as PyTorch Tensor.
         """
         obs = self.env.reset(*args, **kwargs)
-        tensor_obs = torch.as_tensor(obs, dtype=torch.float32)
-        return tensor_obs
+        return self.obs2torch(obs)
 
     def step(self, action: torch.Tensor, *args, **kwargs):
         """
@@ -45,11 +86,8 @@ class ToTorchWrapper(gym.Wrapper):
         - done (bool): Whether the episode is in a terminal state.
         - infos (dict): The info dict from the environment.
         """
-
-        action = self.action2np(action)
-        obs, reward, done, infos = self.env.step(action, *args, **kwargs)
-        tensor_obs = torch.as_tensor(obs, dtype=torch.float32)
-        return tensor_obs, reward, done, infos
+        obs, reward, done, infos = self.env.step(self._action_map(action), *args, **kwargs)
+        return self.obs2torch(obs), reward, done, infos
 
     def action2np(self, action: torch.Tensor):
         """
@@ -61,38 +99,145 @@ class ToTorchWrapper(gym.Wrapper):
         Returns:
         - np_act (np.array or int): The action converted to numpy.
         """
-        if isinstance(self.action_space, gym.spaces.Discrete):
-            action_map = lambda action: int(action.squeeze().numpy())
-        if isinstance(self.action_space, gym.spaces.Box):
-            action_map = lambda action: action.numpy()
+        return self._action_map(action)
+
+# Cell
+class RunningMeanStd:
+    """
+    Running mean and variance of a stream of samples, updated a batch at a time with the parallel variance algorithm
+    of Chan et al. Each update costs one vectorized moment computation over the batch.
+
+    Statistics gathered separately, e.g. by parallel workers, can be combined with `merge`. Set `frozen` to stop
+    updates, e.g. for evaluation, and use `state_dict`/`load_state_dict` to save the statistics with a checkpoint.
+
+    Args:
+    - shape (tuple): Shape of a single sample.
+    - eps (float): Initial sample count, which keeps the first update from dividing by zero.
+    """
+    def __init__(self, shape: Optional[tuple] = (), eps: Optional[float] = 1e-4):
+        self.mean = np.zeros(shape, dtype=np.float64)
+        self.var = np.ones(shape, dtype=np.float64)
+        self.count = eps
+        self.frozen = False
 
-        np_act = action_map(action)
-        return np_act
+    def update(self, x: np.array):
+        """
+        Update the statistics with a batch of samples. Does nothing if the statistics are frozen.
+
+        Args:
+        - x (np.array): Batch of samples, stacked along the first axis.
+        """
+        if self.frozen:
+            return
+        x = np.asarray(x, dtype=np.float64)
+        self.update_from_moments(x.mean(axis=0), x.var(axis=0), x.shape[0])
+
+    def update_from_moments(self, batch_mean: np.array, batch_var: np.array, batch_count: int):
+        """
+        Update the statistics with the mean, variance and size of a batch of samples.
+
+        Args:
+        - batch_mean (np.array): Mean of the batch.
+        - batch_var (np.array): Variance of the batch.
+        - batch_count (int): Number of samples in the batch.
+        """
+        delta = batch_mean - self.mean
+        total = self.count + batch_count
+        self.mean = self.mean + delta * batch_count / total
+        m2 = self.var * self.count + batch_var * batch_count + np.square(delta) * self.count * batch_count / total
+        self.var = m2 / total
+        self.count = total
+
+    def merge(self, other: "RunningMeanStd"):
+        """
+        Merge statistics gathered from other samples into these ones, as if this object had seen those samples too.
+
+        Args:
+        - other (RunningMeanStd): Statistics to merge in.
+
+        Returns:
+        - self (RunningMeanStd): These statistics, so merges can be chained or reduced over.
+        """
+        self.update_from_moments(other.mean, other.var, other.count)
+        return self
+
+    def state_dict(self):
+        """
+        Get the statistics as a dict, e.g. to save them with a model checkpoint.
+
+        Returns:
+        - state (dict): Mean, variance and count of the samples seen.
+        """
+        return {"mean": self.mean.copy(), "var": self.var.copy(), "count": self.count}
+
+    def load_state_dict(self, state: dict):
+        """
+        Load statistics saved with `state_dict`.
+
+        Args:
+        - state (dict): Statistics to load.
+        """
+        self.mean = np.array(state["mean"], dtype=np.float64)
+        self.var = np.array(state["var"], dtype=np.float64)
+        self.count = float(state["count"])
+
+    def normalize(self, x: np.array, eps: Optional[float] = 1e-8):
+        """
+        Normalize samples with the current statistics, without updating them.
+
+        Args:
+        - x (np.array): Samples to normalize.
+        - eps (float): Parameter to avoid division by zero in case variance goes to zero.
+
+        Returns:
+        - norm_x (np.array): Normalized samples.
+        """
+        return (x - self.mean) / (np.sqrt(self.var) + eps)
 
 # Cell
 class StateNormalizeWrapper(gym.Wrapper):
     """
     Environment wrapper for normalizing states.
 
+    The running statistics are kept in a `RunningMeanStd` at `obs_rms`. Pass the same statistics object to several
+    wrappers, or `merge` and `load_state_dict` statistics from other workers, to normalize consistently across
+    collectors. Freeze it (`env.obs_rms.frozen = True`) for evaluation.
+
     Args:
     - env (gym.Env): Environment to wrap.
-    - beta (float): Beta parameter for running mean and variance calculation.
+    - beta (float): Deprecated and ignored. The statistics used to be an exponential moving average with this decay,
+    they are now exact running statistics. Kept in the second position so positional calls don't set `eps`.
     - eps (float): Parameter to avoid division by zero in case variance goes to zero.
+    - obs_rms (RunningMeanStd): Statistics to normalize with. New statistics are created if not given.
     """
-    def __init__(self, env: gym.Env, beta: Optional[float] = 0.99, eps: Optional[float] = 1e-8):
+    def __init__(
+        self,
+        env: gym.Env,
+        beta: Optional[float] = None,
+        eps: Optional[float] = 1e-8,
+        obs_rms: Optional[RunningMeanStd] = None
+    ):
         super().__init__(env)
+        if beta is not None:
+            warnings.warn("StateNormalizeWrapper's beta is deprecated and ignored", DeprecationWarning)
 
         self.env = env
 
-        self.mean = np.zeros(self.observation_space.shape)
-        self.var = np.ones(self.observation_space.shape)
+        self.obs_rms = RunningMeanStd(self.observation_space.shape) if obs_rms is None else obs_rms
 
-        self.beta = beta
         self.eps = eps
 
+    @property
+    def mean(self):
+        return self.obs_rms.mean
+
+    @property
+    def var(self):
+        return self.obs_rms.var
+
     def normalize(self, state: np.array):
         """
-        Update running mean and variance parameters and normalize input state.
+        Update running mean and variance parameters, unless they are frozen, and normalize input state.
 
         Args:
         - state (np.array): State to normalize and to use to calculate update.
@@ -100,9 +245,8 @@ class StateNormalizeWrapper(gym.Wrapper):
         Returns:
         - norm_state (np.array): Normalized state.
         """
-        self.mean = self.beta * self.mean + (1. - self.beta) * state
-        self.var = self.beta * self.var + (1. - self.beta) * np.square(state - self.mean)
-        norm_state = (state - self.mean) / (np.sqrt(self.var) + self.eps)
+        self.obs_rms.update(np.asarray(state)[None])
+        norm_state = self.obs_rms.normalize(state, self.eps)
         return norm_state
 
     def reset(self, *args, **kwargs):
@@ -230,4 +374,352 @@ class BestPracticesWrapper(gym.Wrapper):
         - infos (dict): Dictionary of any info from the environment.
         """
         obs, reward, done, infos = self.env.step(action, *args, **kwargs)
-        return obs, reward, done, infos
\ No newline at end of file
+        return obs, reward, done, infos
+
+# Cell
+class VecToTorchWrapper(gym.vector.VectorEnvWrapper):
+    """
+    Vector environment counterpart of `ToTorchWrapper`. Converts batches of actions from torch.Tensor to np.array, and
+    batches of observations, rewards and dones from np.array to torch.Tensor, with one conversion per batch.
+
+    Args:
+    - env (gym.vector.VectorEnv): Vector environment to wrap.
+    """
+    def reset_wait(self, **kwargs):
+        """
+        Wait for the environments to reset.
+
+        Returns:
+        - tensor_obs (torch.Tensor): Starting observations as a PyTorch Tensor of shape (num_envs, *obs_shape).
+        """
+        obs = self.env.reset_wait(**kwargs)
+        return torch.as_tensor(obs, dtype=torch.float32)
+
+    def step_async(self, actions: torch.Tensor):
+        """
+        Convert a batch of actions to NumPy and send them to the environments.
+
+        Args:
+        - actions (torch.Tensor): Batch of actions, one per environment.
+        """
+        self.env.step_async(actions.numpy() if torch.is_tensor(actions) else actions)
+
+    def step_wait(self):
+        """
+        Wait for the environments to step.
+
+        Returns:
+        - tensor_obs (torch.Tensor): Next observations.
+        - rewards (torch.Tensor): Rewards earned at the current timestep.
+        - dones (torch.Tensor): Boolean Tensor of whether each episode is in a terminal state.
+        - infos (list of dicts): The info dicts from the environments.
+        """
+        obs, rewards, dones, infos = self.env.step_wait()
+        return (
+            torch.as_tensor(obs, dtype=torch.float32),
+            torch.as_tensor(rewards, dtype=torch.float32),
+            torch.as_tensor(dones),
+            infos
+        )
+
+class VecStateNormalizeWrapper(gym.vector.VectorEnvWrapper):
+    """
+    Vector environment counterpart of `StateNormalizeWrapper`. Normalizes a batch of observations with running
+    statistics that are updated once per step from the whole batch.
+
+    The `terminal_observation` in the infos of finished episodes is normalized too, without updating the statistics.
+
+    Args:
+    - env (gym.vector.VectorEnv): Vector environment to wrap.
+    - eps (float): Parameter to avoid division by zero in case variance goes to zero.
+    - obs_rms (RunningMeanStd): Statistics to normalize with. New statistics are created if not given.
+    """
+    def __init__(
+        self, env: gym.vector.VectorEnv, eps: Optional[float] = 1e-8, obs_rms: Optional[RunningMeanStd] = None
+    ):
+        super().__init__(env)
+        self.obs_rms = RunningMeanStd(self.single_observation_space.shape) if obs_rms is None else obs_rms
+        self.eps = eps
+
+    def normalize(self, obs: np.array):
+        """
+        Update running statistics with a batch of observations, unless they are frozen, and normalize it.
+
+        Args:
+        - obs (np.array): Batch of observations, of shape (num_envs, *obs_shape).
+
+        Returns:
+        - norm_obs (np.array): Normalized observations, as float32.
+        """
+        self.obs_rms.update(obs)
+        return self.obs_rms.normalize(obs, self.eps).astype(np.float32)
+
+    def reset_wait(self, **kwargs):
+        """
+        Wait for the environments to reset and return normalized observations.
+
+        Returns:
+        - norm_obs (np.array): Normalized starting observations.
+        """
+        return self.normalize(self.env.reset_wait(**kwargs))
+
+    def step_wait(self):
+        """
+        Wait for the environments to step and normalize the observations.
+
+        Returns:
+        - norm_obs (np.array): Normalized next observations.
+        - rewards (np.array): Rewards earned at the current timestep.
+        - dones (np.array): Whether each episode is over.
+        - infos (list of dicts): Any infos from the environments.
+        """
+        obs, rewards, dones, infos = self.env.step_wait()
+        norm_obs = self.normalize(obs)
+        for info in infos:
+            if "terminal_observation" in info:
+                final_obs = self.obs_rms.normalize(info["terminal_observation"], self.eps)
+                info["terminal_observation"] = final_obs.astype(np.float32)
+        return norm_obs, rewards, dones, infos
+
+class VecRewardScalerWrapper(gym.vector.VectorEnvWrapper):
+    r"""
+    Vector environment counterpart of `RewardScalerWrapper`. Scales a batch of rewards with running statistics that are
+    updated once per step from the whole batch.
+
+    Computes: $(r_t - \mu) / (\sigma + eps)$
+
+    Args:
+    - env (gym.vector.VectorEnv): Vector environment to wrap.
+    - eps (float): Parameter to avoid division by zero in case variance goes to zero.
+    """
+    def __init__(self, env: gym.vector.VectorEnv, eps: Optional[float] = 1e-8):
+        super().__init__(env)
+        self.rew_rms = RunningMeanStd()
+        self.eps = eps
+
+    def scale(self, rewards: np.array):
+        """
+        Update running statistics with a batch of rewards and scale it.
+
+        Args:
+        - rewards (np.array): Batch of rewards, of shape (num_envs,).
+
+        Returns:
+        - scaled_rews (np.array): Scaled rewards.
+        """
+        self.rew_rms.update(rewards)
+        return self.rew_rms.normalize(rewards, self.eps)
+
+    def step_wait(self):
+        """
+        Wait for the environments to step and scale the rewards.
+
+        Returns:
+        - obs (np.array): Next observations.
+        - scaled_rews (np.array): Scaled rewards.
+        - dones (np.array): Whether each episode is over.
+        - infos (list of dicts): Any infos from the environments.
+        """
+        obs, rewards, dones, infos = self.env.step_wait()
+        return obs, self.scale(rewards), dones, infos
+
+# Cell
+class LazyFrames:
+    """
+    A stack of frames which is only concatenated into one array when it is used as an array, e.g. by `np.asarray`.
+
+    Consecutive observations from `FrameStackWrapper` share all but one of their frames, so keeping LazyFrames instead
+    of arrays (e.g. in a replay buffer) stores each frame once instead of once per stacked observation.
+
+    Args:
+    - frames (list of np.array): Frames to stack, oldest first, each of shape (channels, height, width).
+    """
+    def __init__(self, frames: list):
+        self._frames = tuple(frames)
+        self._out = None
+        self.num_frames = len(self._frames)
+
+    def _force(self):
+        if self._out is None:
+            self._out = np.concatenate(self._frames, axis=0)
+            # the frames are now only referenced by the other observations which share them
+            self._frames = None
+        return self._out
+
+    def __array__(self, dtype=None, copy=None):
+        out = self._force()
+        return out if dtype is None else out.astype(dtype)
+
+    def frame(self, i: int):
+        """
+        Get one of the stacked frames without concatenating the stack.
+
+        Args:
+        - i (int): Index of the frame, oldest first.
+
+        Returns:
+        - frame (np.array): The frame, of shape (channels, height, width).
+        """
+        if self._frames is not None:
+            return self._frames[i]
+        channels = self._out.shape[0] // self.num_frames
+        return self._out[i * channels:(i + 1) * channels]
+
+    @property
+    def shape(self):
+        if self._out is not None:
+            return self._out.shape
+        first = self._frames[0]
+        return (first.shape[0] * len(self._frames), *first.shape[1:])
+
+    @property
+    def dtype(self):
+        return self._out.dtype if self._out is not None else self._frames[0].dtype
+
+class FrameStackWrapper(gym.ObservationWrapper):
+    """
+    Environment wrapper for pixel environments, for use with `neuralnets.CNN` policies. Optionally converts frames to
+    grayscale and resizes them, and stacks the last `num_stack` frames along the channel axis.
+
+    Frames are kept as uint8 arrays of shape (channels, height, width) in a fixed-length ring of `num_stack` frames.
+    Each step preprocesses one new frame and returns the stack as `LazyFrames`, instead of copying the whole stack with
+    `np.concatenate`. Observations have shape (num_stack * channels, height, width). Resizing uses nearest-neighbour
+    sampling with indices computed once, when the wrapper is created.
+
+    Args:
+    - env (gym.Env): Environment to wrap. Its observations should be images of shape (height, width, channels) or
+    (height, width).
+    - num_stack (int): Number of frames to stack.
+    - grayscale (bool): Whether to convert RGB frames to grayscale.
+    - size (int or tuple): Size (height, width) to resize frames to. An int gives square frames. If None, frames aren't
+    resized.
+    """
+    def __init__(
+        self,
+        env: gym.Env,
+        num_stack: Optional[int] = 4,
+        grayscale: Optional[bool] = True,
+        size: Optional[Union[int, tuple]] = 84
+    ):
+        super().__init__(env)
+
+        self.num_stack = num_stack
+        self.grayscale = grayscale
+
+        shape = self.env.observation_space.shape
+        height, width = shape[:2]
+        channels = shape[2] if len(shape) == 3 else 1
+        if size is not None:
+            size = (size, size) if np.isscalar(size) else tuple(size)
+            self._rows = np.linspace(0, height - 1, size[0]).round().astype(np.int64)[:, None]
+            self._cols = np.linspace(0, width - 1, size[1]).round().astype(np.int64)
+            height, width = size
+        self.size = size
+
+        if grayscale and channels == 3:
+            self._gray_weights = np.array([0.299, 0.587, 0.114], dtype=np.float32)
+            channels = 1
+        else:
+            self._gray_weights = None
+
+        self.frame_shape = (channels, height, width)
+        self.observation_space = gym.spaces.Box(
+            low=0, high=255, shape=(num_stack * channels, height, width), dtype=np.uint8
+        )
+        self.frames = collections.deque(maxlen=num_stack)
+
+    def process_frame(self, frame: np.array):
+        """
+        Resize, convert to grayscale and transpose one frame to a uint8 array of shape (channels, height, width).
+
+        Args:
+        - frame (np.array): Frame from the environment.
+
+        Returns:
+        - processed (np.array): Processed frame.
+        """
+        if self.size is not None:
+            frame = frame[self._rows, self._cols]
+        if self._gray_weights is not None:
+            frame = frame @ self._gray_weights
+        if frame.ndim == 2:
+            frame = frame[..., None]
+        return np.ascontiguousarray(frame.transpose(2, 0, 1), dtype=np.uint8)
+
+    def reset(self, **kwargs):
+        """
+        Reset the environment and fill the stack with the first frame.
+
+        Returns:
+        - obs (LazyFrames): Stacked frames.
+        """
+        frame = self.process_frame(self.env.reset(**kwargs))
+        for _ in range(self.num_stack):
+            self.frames.append(frame)
+        return LazyFrames(self.frames)
+
+    def observation(self, observation: np.array):
+        """
+        Push a new frame onto the stack.
+
+        Args:
+        - observation (np.array): Frame from the environment.
+
+        Returns:
+        - obs (LazyFrames): Stacked frames.
+        """
+        self.frames.append(self.process_frame(observation))
+        return LazyFrames(self.frames)
+
+# Cell
+class ActionRepeatWrapper(gym.Wrapper):
+    """
+    Environment wrapper which repeats each action for `repeat` steps of the wrapped environment and sums their
+    rewards, stopping early if the episode ends. Apply it directly to the raw environment, beneath the other wrappers,
+    so the conversions and normalization in those wrappers and the policy forward pass only run once per `repeat` steps.
+
+    With `max_pool`, the returned observation is the pixel-wise maximum of the last two frames, which removes the
+    flicker of objects only drawn on alternate frames in some pixel environments. Both frames are written into a
+    buffer allocated once, when the wrapper is created. When the episode ends early, the final frame is returned as is.
+
+    The info dict of the last repeated step is returned, with the number of steps taken under "action_repeats".
+
+    Args:
+    - env (gym.Env): Environment to wrap.
+    - repeat (int): Number of environment steps to repeat each action for.
+    - max_pool (bool): Whether to max-pool the last two frames.
+    """
+    def __init__(self, env: gym.Env, repeat: Optional[int] = 4, max_pool: Optional[bool] = False):
+        super().__init__(env)
+
+        self.repeat = repeat
+        self.max_pool = max_pool and repeat > 1
+        if self.max_pool:
+            space = self.observation_space
+            self._obs_buffer = np.zeros((2, *space.shape), dtype=space.dtype)
+
+    def step(self, action: Union[np.array, int, float]):
+        """
+        Step the environment `repeat` times with the same action, or until the episode ends.
+
+        Args:
+        - action (np.array or int or float): Action to use to step the environment.
+
+        Returns:
+        - obs (np.array): Next observation, max-pooled over the last two frames if `max_pool` is set.
+        - total_reward (float): Sum of the rewards of the repeated steps.
+        - done (bool): Whether the episode is over.
+        - infos (dict): The info dict from the last environment step.
+        """
+        total_reward = 0.
+        for i in range(self.repeat):
+            obs, reward, done, infos = self.env.step(action)
+            total_reward += reward
+            if self.max_pool and i >= self.repeat - 2:
+                self._obs_buffer[i - self.repeat + 2] = obs
+            if done:
+                break
+        infos["action_repeats"] = i + 1
+        if self.max_pool and i == self.repeat - 1:
+            obs = self._obs_buffer.max(axis=0)
+        return obs, total_reward, done, infos
\ No newline at end of file
@@ -1,6 +1,7 @@
 # AUTOGENERATED! DO NOT EDIT! File to edit: nbs/06_loops.ipynb (unless otherwise specified).
 
-__all__ = ['polgrad_interaction_loop']
+__all__ = ['EpisodeStats', 'InfoAggregator', 'polgrad_interaction_loop', 'vec_polgrad_interaction_loop',
+           'RolloutWorkerPool', 'AsyncRolloutCollector', 'offpolicy_interaction_loop']
 
 # Cell
 import gym
@@ -9,6 +10,115 @@ from rl_bolts import buffers, env_wrappers, neuralnets
 import torch
 import torch.nn as nn
 import torch.nn.functional as F
+import torch.multiprocessing as mp
+import copy
+import numbers
+import threading
+from typing import Callable, List, Optional, Union
+
+# Cell
+def _stack(xs: list) -> torch.Tensor:
+    """Stack a list of per-step tensors, arrays or numbers into one float32 tensor."""
+    return torch.stack([torch.as_tensor(x, dtype=torch.float32) for x in xs])
+
+def _copy(x):
+    """Copy an observation which is kept across env steps, since the env may reuse its memory for the next one."""
+    return x.clone() if torch.is_tensor(x) else np.array(x, copy=True)
+
+# Cell
+class EpisodeStats:
+    """
+    Constant-memory running statistics of episode returns and lengths, updated one finished episode at a time with
+    Welford's algorithm. Replaces keeping a list of every return and length.
+    """
+
+    def __init__(self):
+        self.count = 0
+        # running mean and sum of squared deviations of [return, length]
+        self.mean = np.zeros(2)
+        self.m2 = np.zeros(2)
+        self.max_ret, self.min_ret = -np.inf, np.inf
+
+    def add(self, ret: float, length: int):
+        """
+        Add one finished episode.
+
+        Args:
+        - ret (float): Return of the episode.
+        - length (int): Length of the episode.
+        """
+        self.count += 1
+        x = np.array([ret, length], dtype=np.float64)
+        delta = x - self.mean
+        self.mean += delta / self.count
+        self.m2 += delta * (x - self.mean)
+        self.max_ret, self.min_ret = max(self.max_ret, float(ret)), min(self.min_ret, float(ret))
+
+    def infos(self) -> dict:
+        """
+        Summarize the episodes added so far.
+
+        Returns:
+        - infos (dict): Mean, std, max and min of episode returns, mean and std of episode lengths, and the number of
+        episodes. Only "NumEpisodes" is given when no episode has finished.
+        """
+        if self.count == 0:
+            return {"NumEpisodes": 0}
+        std = np.sqrt(self.m2 / self.count)
+        return {
+            "MeanEpReturn": self.mean[0],
+            "StdEpReturn": std[0],
+            "MaxEpReturn": self.max_ret,
+            "MinEpReturn": self.min_ret,
+            "MeanEpLength": self.mean[1],
+            "StdEpLength": std[1],
+            "NumEpisodes": self.count
+        }
+
+class InfoAggregator:
+    """
+    Streaming aggregation of environment info dicts, for interaction loops that would otherwise keep every info dict.
+
+    For each aggregated key, it tracks how many infos held the key, the last value, and the mean of numeric values.
+
+    Args:
+    - keys (list of str): Info keys to aggregate. If None, every key is aggregated. An empty list drops the infos
+    entirely.
+    """
+
+    def __init__(self, keys: Optional[List[str]] = None):
+        self.keys = None if keys is None else list(keys)
+        self.counts, self.sums, self.last = {}, {}, {}
+
+    def update(self, info: dict):
+        """
+        Add one info dict.
+
+        Args:
+        - info (dict): Info dict returned by an environment step.
+        """
+        keys = info if self.keys is None else [k for k in self.keys if k in info]
+        for k in keys:
+            v = info[k]
+            self.counts[k] = self.counts.get(k, 0) + 1
+            self.last[k] = v
+            if isinstance(v, (numbers.Number, np.bool_)):
+                self.sums[k] = self.sums.get(k, 0.) + float(v)
+
+    def summary(self) -> dict:
+        """
+        Summarize the infos added so far.
+
+        Returns:
+        - summary (dict): For each aggregated key, a dict with its "count", "last" value, and "mean" if its values
+        were numeric.
+        """
+        summary = {}
+        for k, count in self.counts.items():
+            summary[k] = {"count": count, "last": self.last[k]}
+            if k in self.sums:
+                summary[k]["mean"] = self.sums[k] / count
+        return summary
 
 # Cell
 def polgrad_interaction_loop(
@@ -16,7 +126,9 @@ def polgrad_interaction_loop(
     agent: nn.Module,
     buffer: buffers.PGBuffer,
     num_interactions: int = 4000,
-    horizon: int = 1000
+    horizon: int = 1000,
+    info_agg: Optional[InfoAggregator] = None,
+    defer_values: bool = False
 ):
     """
     Interaction loop for actor-critic policy gradient agent.
@@ -24,42 +136,60 @@ def polgrad_interaction_loop(
     This loop does not handle converting between PyTorch Tensors and NumPy arrays. So either your env should first be wrapped
     in `ToTorchWrapper` or your agent should accept and return NumPy arrays.
 
+    Interactions are collected locally and written to the buffer in one block with `store_batch` and `finish_paths`
+    at the end of the loop, instead of with a `store` call per step. Observations are copied into a preallocated
+    batch before each step, so envs which reuse their observation memory (such as `ToTorchWrapper` with `preallocate`)
+    are safe to use.
+
+    With `defer_values`, only the policy runs at each step (`agent.step(obs, compute_value=False)`). The values of all
+    collected observations and of the bootstrap observations are then computed in one batched `agent.value_f` call
+    before the advantages are calculated.
+
     Args:
     - env (gym.Env): Environment to run in.
     - agent (nn.Module): Agent to run within the environment, generates actions, values, and logprobs at each step.
-    - buffer (rl_bolts.buffers.PGBuffer-like): Buffer object with same API and function signatures as the PGBuffer.
+    - buffer (rl_bolts.buffers.PGBuffer-like): Buffer object with same API and function signatures as the PGBuffer,
+    including `store_batch` and `finish_paths`.
     - num_interactions (int): How many interactions to collect in the environment.
     - horizon (int): Maximum allowed episode length.
+    - info_agg (InfoAggregator): If given, environment info dicts are streamed into it instead of kept in a list.
+    - defer_values (bool): Whether to compute values in one batch at the end of the loop instead of at every step.
 
     Returns:
     - buffer (rl_bolts.buffers.PGBuffer-like): Buffer filled with interactions.
     - infos (dict): Dictionary of reward and episode length statistics.
-    - env_infos (list of dicts): List of all info dicts from the environment.
+    - env_infos (list of dicts or dict): List of all info dicts from the environment, or `info_agg.summary()` if
+    `info_agg` was given.
     """
 
     env_infos = []
+    stats = EpisodeStats()
 
-    rets = []
-    lens = []
+    act_list, rew_list, val_list, logp_list = [], [], [], []
+    start, ends, last_vals = buffer.ptr, [], []
+    boot_obs, boot_idxs = [], []
 
     ret = 0
     length = 0
 
     obs = env.reset()
+    obs_batch = torch.empty((num_interactions, *np.shape(obs)), dtype=torch.float32)
 
     for i in range(num_interactions):
-        action, logp, value = agent.step(obs)
+        # copy before stepping, the env may write the next observation into the same memory
+        obs_batch[i] = torch.as_tensor(obs)
+        action, logp, value = agent.step(obs, compute_value=False) if defer_values else agent.step(obs)
 
         next_obs, reward, done, env_info = env.step(action)
-        env_infos.append(env_info)
-
-        buffer.store(
-            obs,
-            action,
-            reward,
-            value,
-            logp
-        )
+        if info_agg is None:
+            env_infos.append(env_info)
+        else:
+            info_agg.update(env_info)
+
+        act_list.append(action)
+        rew_list.append(reward)
+        val_list.append(value)
+        logp_list.append(logp)
 
         ret += reward
         length += 1
@@ -71,28 +201,552 @@ def polgrad_interaction_loop(
         epoch_ended = i == num_interactions - 1
 
         if over or epoch_ended:
-            if timeup or epoch_ended:
+            if (timeup or epoch_ended) and defer_values:
+                boot_obs.append(torch.as_tensor(obs, dtype=torch.float32).clone())
+                boot_idxs.append(len(last_vals))
+                last_val = 0
+            elif timeup or epoch_ended:
                 with torch.no_grad():
                     last_val = agent.value_f(obs)
 
             else:
                 last_val = 0
 
-            buffer.finish_path(last_val)
+            ends.append(start + i + 1)
+            last_vals.append(float(last_val))
 
             if over:
-                rets.append(ret)
-                lens.append(length)
+                stats.add(ret, length)
 
             obs, ret, length = env.reset(), 0, 0
 
-    infos = {
-        "MeanEpReturn": np.mean(rets),
-        "StdEpReturn": np.std(rets),
-        "MaxEpReturn": np.max(rets),
-        "MinEpReturn": np.min(rets),
-        "MeanEpLength": np.mean(lens),
-        "StdEpLength": np.std(lens)
-    }
+    if defer_values:
+        # one critic pass over the collected and the bootstrap observations
+        with torch.no_grad():
+            values = agent.value_f(torch.cat([obs_batch, _stack(boot_obs)])).reshape(-1)
+        val_batch = values[:num_interactions]
+        for j, v in zip(boot_idxs, values[num_interactions:]):
+            last_vals[j] = float(v)
+    else:
+        val_batch = _stack(val_list).reshape(-1)
+
+    buffer.store_batch(
+        obs_batch,
+        _stack(act_list),
+        _stack(rew_list).reshape(-1),
+        val_batch,
+        _stack(logp_list).reshape(-1)
+    )
+    buffer.finish_paths(ends, last_vals)
+
+    infos = stats.infos()
+
+    return buffer, infos, env_infos if info_agg is None else info_agg.summary()
+
+# Cell
+def vec_polgrad_interaction_loop(
+    envs: Union[gym.vector.VectorEnv, List[gym.Env]],
+    agent: nn.Module,
+    buffer: buffers.VecPGBuffer,
+    horizon: int = 1000,
+    info_agg: Optional[InfoAggregator] = None,
+    defer_values: bool = False
+):
+    """
+    Interaction loop for actor-critic policy gradient agent over a batch of environments.
+
+    Every tick calls `agent.step` once on the stacked observations of all environments, so network overhead is paid
+    once per tick instead of once per environment. Runs until every environment has filled its row of the buffer.
+
+    The environments can return NumPy arrays, as `gym.vector` environments do, or PyTorch Tensors, as a
+    `VecToTorchWrapper` does. Observations are converted to PyTorch Tensors for the agent and actions back to NumPy
+    for the environments, and rewards and dones are read as NumPy arrays once per tick.
+
+    Episodes cut off by the horizon, or by a `TimeLimit` wrapper (`info["TimeLimit.truncated"]`), are bootstrapped with
+    the value of their final observation. A `gym.vector.VectorEnv` resets its environments itself, so the horizon
+    only applies to lists of environments; use `TimeLimit` to cut off episodes in vector environments.
+
+    With `defer_values`, only the policy runs at each tick (`agent.step(obs, compute_value=False)`). The values of all
+    collected observations, of the final observations of cut off episodes and of the last observations are then
+    computed in one batched `agent.value_f` call, and the rollout is stored with `buffer.store_batch`.
+
+    Args:
+    - envs (gym.vector.VectorEnv or list of gym.Env): Environments to run in.
+    - agent (nn.Module): Agent to run within the environments, generates actions, values, and logprobs for a batch of
+    observations at each step.
+    - buffer (rl_bolts.buffers.VecPGBuffer-like): Buffer object with same API and function signatures as the
+    VecPGBuffer, with one row per environment.
+    - horizon (int): Maximum allowed episode length.
+    - info_agg (InfoAggregator): If given, environment info dicts are streamed into it instead of kept in a list.
+    - defer_values (bool): Whether to compute values in one batch at the end of the loop instead of at every tick.
+
+    Returns:
+    - buffer (rl_bolts.buffers.VecPGBuffer-like): Buffer filled with interactions.
+    - infos (dict): Dictionary of reward and episode length statistics.
+    - env_infos (list of lists of dicts or dict): Info dicts from every environment at every step, or
+    `info_agg.summary()` if `info_agg` was given.
+    """
+    vector = isinstance(envs, gym.vector.VectorEnv)
+    num_envs = envs.num_envs if vector else len(envs)
+    assert num_envs == buffer.num_envs, "the buffer needs one row per environment"
+
+    env_infos = []
+    stats = EpisodeStats()
+
+    ep_rets = np.zeros(num_envs)
+    ep_lens = np.zeros(num_envs, dtype=np.int64)
+
+    obs = envs.reset() if vector else np.stack([env.reset() for env in envs])
+
+    num_ticks = buffer.max_size - buffer.ptr
+    if defer_values:
+        obs_batch = torch.empty((num_envs, num_ticks, *np.shape(obs)[1:]), dtype=torch.float32)
+        rew_batch = np.zeros((num_envs, num_ticks), dtype=np.float32)
+        done_batch = np.zeros((num_envs, num_ticks), dtype=bool)
+        act_list, logp_list = [], []
+        boot_obs, boot_idxs = [], []
+
+    for i in range(num_ticks):
+        obs = torch.as_tensor(obs, dtype=torch.float32)
+        if defer_values:
+            obs_batch[:, i] = obs
+            action, logp, value = agent.step(obs, compute_value=False)
+        else:
+            action, logp, value = agent.step(obs)
+
+        if vector:
+            next_obs, rewards, dones, step_infos = envs.step(action.numpy())
+            # no copies for NumPy arrays or CPU tensors
+            next_obs, rewards, dones = np.asarray(next_obs), np.asarray(rewards), np.asarray(dones)
+            final_obs = np.stack([info.get("terminal_observation", o) for info, o in zip(step_infos, next_obs)])
+            truncated = np.array([info.get("TimeLimit.truncated", False) for info in step_infos])
+        else:
+            next_obs, rewards, dones, step_infos, final_obs, truncated = _step_env_list(
+                envs, action.numpy(), ep_lens + 1 == horizon
+            )
+        if info_agg is None:
+            env_infos.append(step_infos)
+        else:
+            for info in step_infos:
+                info_agg.update(info)
+
+        ep_rets += rewards
+        ep_lens += 1
+
+        # fold the bootstrap value of cut off episodes into their last reward, then mark them done
+        stored_rewards = np.array(rewards, dtype=np.float32)
+        if truncated.any() and defer_values:
+            boot_obs.append(torch.as_tensor(final_obs[truncated], dtype=torch.float32))
+            boot_idxs.append((np.nonzero(truncated)[0], i))
+        elif truncated.any():
+            with torch.no_grad():
+                final_vals = agent.value_f(torch.as_tensor(final_obs[truncated], dtype=torch.float32))
+            stored_rewards[truncated] += buffer.gamma * final_vals.numpy()
+
+        if defer_values:
+            rew_batch[:, i], done_batch[:, i] = stored_rewards, dones
+            act_list.append(action)
+            logp_list.append(logp)
+        else:
+            buffer.store(obs, action, stored_rewards, value, logp, dones)
+
+        for j in np.nonzero(dones)[0]:
+            stats.add(ep_rets[j], ep_lens[j])
+        ep_rets[dones], ep_lens[dones] = 0, 0
+
+        obs = next_obs
+
+    obs = torch.as_tensor(obs, dtype=torch.float32)
+    if defer_values:
+        # one critic pass over the collected, the cut off and the last observations
+        num_collected = num_envs * num_ticks
+        with torch.no_grad():
+            values = agent.value_f(torch.cat([obs_batch.reshape(num_collected, *obs.shape[1:]), *boot_obs, obs]))
+        values = values.reshape(-1)
+        boot_vals = values[num_collected:-num_envs].numpy()
+        for env_idxs, t in boot_idxs:
+            rew_batch[env_idxs, t] += buffer.gamma * boot_vals[:len(env_idxs)]
+            boot_vals = boot_vals[len(env_idxs):]
+        buffer.store_batch(
+            obs_batch,
+            torch.stack(act_list, dim=1),
+            rew_batch,
+            values[:num_collected].reshape(num_envs, num_ticks),
+            torch.stack(logp_list, dim=1),
+            done_batch
+        )
+        last_val = values[-num_envs:]
+    else:
+        with torch.no_grad():
+            last_val = agent.value_f(obs)
+    buffer.finish_path(last_val)
+
+    infos = stats.infos()
+
+    return buffer, infos, env_infos if info_agg is None else info_agg.summary()
+
+
+def _step_env_list(envs: List[gym.Env], actions: np.array, timeups: np.array):
+    """
+    Step a list of environments like a `gym.vector.VectorEnv`, resetting the ones whose episodes end.
+
+    Returns:
+    - next_obs (np.array): Next observations, from a new episode where one ended.
+    - rewards (np.array): Rewards.
+    - dones (np.array): Whether each episode ended, by reaching a terminal state or being cut off.
+    - infos (list of dicts): Info dicts from the environments.
+    - final_obs (np.array): Final observations of the episodes that ended; equal to next_obs elsewhere.
+    - truncated (np.array): Whether each episode was cut off by the horizon or a time limit.
+    """
+    next_obs, rewards, dones, infos = [], [], [], []
+    for env, action in zip(envs, actions):
+        o, r, d, info = env.step(action)
+        next_obs.append(o)
+        rewards.append(r)
+        dones.append(d)
+        infos.append(info)
+    final_obs, next_obs = np.stack(next_obs), np.stack(next_obs)
+    truncated = np.array([info.get("TimeLimit.truncated", False) for info in infos]) | (timeups & ~np.array(dones))
+    dones = np.array(dones) | truncated
+    for j in np.nonzero(dones)[0]:
+        next_obs[j] = envs[j].reset()
+    return next_obs, np.array(rewards), dones, infos, final_obs, truncated
+
+# Cell
+class RolloutWorkerPool:
+    """
+    A pool of worker processes which collect policy gradient rollouts in parallel.
+
+    Each worker has its own environment and its own CPU copy of the agent, and fills its slice of a
+    `SharedPGBuffer` with `polgrad_interaction_loop`, computing the values in one batched pass per rollout
+    (`defer_values`). On every `collect` call the latest agent weights are copied into a shared-memory copy of the
+    agent, which the workers load before collecting, so weights are broadcast without pickling. The filled buffer is shared with the learner, so the merged batch is ready to `get` as soon
+    as the workers finish.
+
+    Args:
+    - env_fn (callable): Function creating a new environment, wrapped in `ToTorchWrapper`. Called once in each worker.
+    Has to be picklable (e.g. a module level function or `functools.partial`) unless the start method is "fork".
+    - agent (nn.Module): Agent to collect rollouts with. Only its architecture is used here; pass the agent with the
+    latest weights to `collect`.
+    - buffer (rl_bolts.buffers.SharedPGBuffer): Shared buffer with one slice per worker.
+    - horizon (int): Maximum allowed episode length.
+    - seed (int): Base random seed. Worker i is seeded with seed + i.
+    - start_method (str): multiprocessing start method. Defaults to the platform default.
+    """
+    def __init__(
+        self,
+        env_fn: Callable[[], gym.Env],
+        agent: nn.Module,
+        buffer: buffers.SharedPGBuffer,
+        horizon: int = 1000,
+        seed: int = 0,
+        start_method: Optional[str] = None
+    ):
+        self.buffer = buffer
+        self.shared_agent = copy.deepcopy(agent).cpu().share_memory()
+        ctx = mp.get_context(start_method)
+        self.commands = [ctx.SimpleQueue() for _ in range(buffer.num_workers)]
+        self.results = ctx.SimpleQueue()
+        self.workers = [
+            ctx.Process(
+                target=_rollout_worker,
+                args=(i, env_fn, self.shared_agent, buffer.worker_buffer(i), horizon, seed + i, self.commands[i], self.results),
+                daemon=True
+            )
+            for i in range(buffer.num_workers)
+        ]
+        for worker in self.workers:
+            worker.start()
+
+    def collect(self, agent: nn.Module):
+        """
+        Broadcast the agent's weights to the workers and have every worker fill its slice of the buffer.
+
+        Args:
+        - agent (nn.Module): Agent with the latest weights.
+
+        Returns:
+        - buffer (rl_bolts.buffers.SharedPGBuffer): The shared buffer, full and finished.
+        - infos (dict): Dictionary of reward and episode length statistics over all workers.
+        """
+        with torch.no_grad():
+            for shared, param in zip(self.shared_agent.state_dict().values(), agent.state_dict().values()):
+                shared.copy_(param)
+        for commands in self.commands:
+            commands.put("collect")
+        worker_infos = [self.results.get() for _ in self.workers]
+        for info in worker_infos:
+            if isinstance(info, Exception):
+                raise info
+        return self.buffer, _merge_infos(worker_infos)
+
+    def close(self):
+        """
+        Stop the worker processes.
+        """
+        for commands in self.commands:
+            commands.put(None)
+        for worker in self.workers:
+            worker.join()
+
+
+def _rollout_worker(
+    worker_id: int,
+    env_fn: Callable[[], gym.Env],
+    shared_agent: nn.Module,
+    buffer: buffers.PGBuffer,
+    horizon: int,
+    seed: int,
+    commands,
+    results
+):
+    """Worker process loop for `RolloutWorkerPool`: load the shared weights and fill the buffer slice on each command."""
+    # workers run side by side, so one thread each avoids oversubscribing the cores
+    torch.set_num_threads(1)
+    np.random.seed(seed)
+    torch.manual_seed(seed)
+    env = env_fn()
+    env.seed(seed)
+    agent = copy.deepcopy(shared_agent)
+    while commands.get() is not None:
+        try:
+            agent.load_state_dict(shared_agent.state_dict())
+            _, infos, _ = polgrad_interaction_loop(
+                env, agent, buffer, buffer.max_size, horizon, info_agg=InfoAggregator(keys=[]), defer_values=True
+            )
+            results.put(infos)
+        except Exception as e:
+            # hand the error to the learner instead of leaving it waiting on this worker
+            results.put(e)
+
+
+def _merge_infos(infos: List[dict]) -> dict:
+    """
+    Combine episode statistics from several `polgrad_interaction_loop` calls, weighting each by its episode count.
+    """
+    # workers which didn't finish an episode only report the count
+    infos = [info for info in infos if info["NumEpisodes"] > 0]
+    if len(infos) == 0:
+        return {"NumEpisodes": 0}
+    counts = np.array([info["NumEpisodes"] for info in infos])
+    merged = {"NumEpisodes": int(counts.sum())}
+    for name in ("EpReturn", "EpLength"):
+        means = np.array([info[f"Mean{name}"] for info in infos])
+        stds = np.array([info[f"Std{name}"] for info in infos])
+        mean = np.average(means, weights=counts)
+        merged[f"Mean{name}"] = mean
+        # pooled std: average second moment about the overall mean
+        merged[f"Std{name}"] = np.sqrt(np.average(stds ** 2 + (means - mean) ** 2, weights=counts))
+    merged["MaxEpReturn"] = max(info["MaxEpReturn"] for info in infos)
+    merged["MinEpReturn"] = min(info["MinEpReturn"] for info in infos)
+    return {k: merged[k] for k in infos[0]}
+
+# Cell
+class AsyncRolloutCollector:
+    """
+    Collects the next batch of rollouts in a background thread while the current batch is being trained on.
+
+    Collection runs with a snapshot of the agent taken when it starts, so training can keep updating the agent. The
+    batch is therefore collected by a policy which lags behind the one it is trained with; `wait` returns the version
+    of the snapshot so the lag can be tracked and corrected for. The collected data is copied out of the buffer, so the
+    buffer can be reused for the next collection while training on it.
+
+    Collection in this process still competes for the GIL with training, so the overlap is best when `collect_fn`
+    mostly waits, e.g. on a `RolloutWorkerPool`.
+
+    Args:
+    - collect_fn (callable): Function taking an agent and collecting a full buffer with it. Has to return
+    `(buffer, infos, ...)`, like `polgrad_interaction_loop` and `RolloutWorkerPool.collect`.
+    - agent (nn.Module): Agent to snapshot. Only its architecture is used here.
+    """
+    def __init__(
+        self,
+        collect_fn: Callable[[nn.Module], tuple],
+        agent: nn.Module
+    ):
+        self.collect_fn = collect_fn
+        self.snapshot = copy.deepcopy(agent)
+        self.snapshot_version = None
+        self._thread, self._result = None, None
+
+    @property
+    def running(self) -> bool:
+        """Whether a collection has been started and not waited for yet."""
+        return self._thread is not None
+
+    def start(self, agent: nn.Module, version: int = 0):
+        """
+        Snapshot the agent's weights and start collecting a batch with them in the background.
+
+        Args:
+        - agent (nn.Module): Agent with the weights to collect with.
+        - version (int): Version of the agent's weights, e.g. the number of training epochs so far.
+        """
+        assert not self.running, "wait for the running collection before starting another"
+        self.snapshot.load_state_dict(agent.state_dict())
+        self.snapshot_version = version
+        self._thread = threading.Thread(target=self._collect, daemon=True)
+        self._thread.start()
+
+    def _collect(self):
+        try:
+            buffer, infos = self.collect_fn(self.snapshot)[:2]
+            self._result = [x.clone() for x in buffer.get()], infos
+        except Exception as e:
+            # hand the error to the thread calling wait
+            self._result = e
+
+    def wait(self):
+        """
+        Wait for the running collection to finish.
+
+        Returns:
+        - data (list of torch.Tensor): Output of the buffer's `get`, copied out of the buffer.
+        - infos (dict): Dictionary of reward and episode length statistics.
+        - version (int): Version of the weights the batch was collected with.
+        """
+        self._thread.join()
+        self._thread = None
+        result, self._result = self._result, None
+        if isinstance(result, Exception):
+            raise result
+        data, infos = result
+        return data, infos, self.snapshot_version
+
+# Cell
+def _takes_torch_actions(env: gym.Env) -> bool:
+    """Whether `env` is wrapped in a `ToTorchWrapper` somewhere along its wrapper chain, so it expects tensor actions."""
+    while isinstance(env, gym.Wrapper):
+        if isinstance(env, env_wrappers.ToTorchWrapper):
+            return True
+        env = env.env
+    return False
+
+def _random_actions(space: gym.Space, n: int):
+    """
+    Sample `n` uniformly random actions from an action space in one call, as a tensor stacked along the first axis.
+
+    Box and Discrete spaces are sampled in a single vectorized draw. Other spaces fall back to `space.sample()` per action.
+    """
+    if isinstance(space, gym.spaces.Box):
+        low = np.broadcast_to(space.low, space.shape)
+        high = np.broadcast_to(space.high, space.shape)
+        acts = np.random.uniform(low, high, size=(n, *space.shape))
+        return torch.as_tensor(acts, dtype=torch.float32)
+    if isinstance(space, gym.spaces.Discrete):
+        return torch.randint(space.n, (n,))
+    return _stack([space.sample() for _ in range(n)])
+
+# Cell
+def offpolicy_interaction_loop(
+    env: gym.Env,
+    act_fn: Callable,
+    buffer: buffers.ReplayBuffer,
+    update_fn: Callable,
+    num_interactions: int = 4000,
+    steps_so_far: int = 0,
+    start_steps: int = 10000,
+    update_after: int = 1000,
+    update_every: int = 50,
+    utd_ratio: float = 1.,
+    batch_size: int = 100,
+    horizon: int = 1000,
+    info_agg: Optional[InfoAggregator] = None
+):
+    """
+    Interaction loop for off-policy agents (DDPG, TD3, SAC, ...) that interleaves environment steps with gradient updates.
+
+    The first `start_steps` interactions (counted across calls through `steps_so_far`) use uniformly random actions,
+    which are drawn in one batch up front. After that, `act_fn(obs)` picks the actions. Once `update_after` interactions
+    have been collected, every `update_every` steps run `round(update_every * utd_ratio)` updates, each of which calls
+    `update_fn` on a fresh batch from `buffer.sample_batch`. Batches are sampled into the same preallocated tensors, so
+    `update_fn` should not hold on to them. It can compute the `ddpg_qfunc_loss`/`td3_qfunc_loss`/`sac_qfunc_loss`
+    losses, step its optimizers and return a dict of scalar statistics, which are averaged into `infos`.
+
+    Episodes cut off by `horizon` or by a gym `TimeLimit` are stored as not done, so the Q targets keep bootstrapping.
+
+    Like `polgrad_interaction_loop`, this loop does not handle converting between PyTorch Tensors and NumPy arrays.
+    The warm-up actions and the stored transitions are tensors, so `env` has to be wrapped in a `ToTorchWrapper`
+    (possibly under other wrappers).
+    The current observation is copied at each step, so envs which reuse their observation memory (such as
+    `ToTorchWrapper` with `preallocate`) are safe to use.
+
+    Args:
+    - env (gym.Env): Environment to run in, wrapped in a `ToTorchWrapper`.
+    - act_fn (Callable): Function mapping an observation to an action, e.g. a noisy `MLPQActor.act`.
+    - buffer (rl_bolts.buffers.ReplayBuffer-like): Replay buffer to store interactions in and sample updates from.
+    - update_fn (Callable): Function called with each sampled batch `(obs, obs2, act, rew, done)`. May return a dict of
+    statistics or None.
+    - num_interactions (int): How many interactions to collect in the environment.
+    - steps_so_far (int): Number of interactions collected by earlier calls, used for the warm-up and update schedule.
+    - start_steps (int): Number of initial interactions that use random actions.
+    - update_after (int): Number of interactions to collect before the first update.
+    - update_every (int): Number of interactions between rounds of updates.
+    - utd_ratio (float): Update-to-data ratio, the number of updates per collected interaction.
+    - batch_size (int): Size of the batches passed to `update_fn`.
+    - horizon (int): Maximum allowed episode length.
+    - info_agg (InfoAggregator): If given, environment info dicts are streamed into it instead of kept in a list.
+
+    Returns:
+    - buffer (rl_bolts.buffers.ReplayBuffer-like): Buffer filled with interactions.
+    - infos (dict): Dictionary of reward and episode length statistics (if any episode finished), the number of updates
+    run and the averaged statistics returned by `update_fn`.
+    - env_infos (list of dicts or dict): List of all info dicts from the environment, or `info_agg.summary()` if
+    `info_agg` was given.
+    """
+
+    assert _takes_torch_actions(env), "offpolicy_interaction_loop needs an env wrapped in ToTorchWrapper"
+
+    env_infos = []
+    stats = EpisodeStats()
+    update_agg = InfoAggregator()
+    num_updates = 0
+
+    ret = 0
+    length = 0
+
+    num_random = int(np.clip(start_steps - steps_so_far, 0, num_interactions))
+    random_actions = _random_actions(env.action_space, num_random)
+    updates_per_round = int(round(update_every * utd_ratio))
+    batch = buffer.alloc_batch(batch_size)
+
+    obs = _copy(env.reset())
+
+    for i in range(num_interactions):
+        action = random_actions[i] if i < num_random else act_fn(obs)
+
+        next_obs, reward, done, env_info = env.step(action)
+        if info_agg is None:
+            env_infos.append(env_info)
+        else:
+            info_agg.update(env_info)
+
+        ret += reward
+        length += 1
+
+        timeup = length == horizon
+        # only true terminal states stop the bootstrap, time limits don't
+        terminal = done and not env_info.get("TimeLimit.truncated", False)
+        # the loop knows where episodes start, so the buffer doesn't have to compare observations
+        buffer.store(obs, action, reward, next_obs, terminal, new_episode=length == 1)
+
+        obs = _copy(next_obs)
+
+        if done or timeup:
+            stats.add(ret, length)
+            obs, ret, length = _copy(env.reset()), 0, 0
+
+        t = steps_so_far + i + 1
+        if t >= update_after and t % update_every == 0:
+            for _ in range(updates_per_round):
+                update_info = update_fn(buffer.sample_batch(batch_size, out=batch))
+                if update_info is not None:
+                    update_agg.update(update_info)
+                num_updates += 1
+
+    infos = stats.infos()
+    infos["NumUpdates"] = num_updates
+    for k, v in update_agg.summary().items():
+        infos[k] = v.get("mean", v["last"])
 
-    return buffer, infos, env_infos
\ No newline at end of file
+    return buffer, infos, env_infos if info_agg is None else info_agg.summary()
\ No newline at end of file
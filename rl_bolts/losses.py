@@ -112,7 +112,9 @@ def ddpg_qfunc_loss(
     qfunc: nn.Module,
     qfunc_target: nn.Module,
     policy_target: nn.Module,
-    gamma: Optional[float] = 0.99
+    gamma: Optional[float] = 0.99,
+    weights: Optional[torch.Tensor] = None,
+    discounts: Optional[torch.Tensor] = None,
     ):
     """
     Loss for a DDPG Q-function. See the paper: https://arxiv.org/abs/1509.02971
@@ -124,6 +126,9 @@ def ddpg_qfunc_loss(
     - qfunc_target (nn.Module): Q-function target network.
     - policy_target (nn.Module): Policy target network.
     - gamma (float): Discount factor.
+    - weights (torch.Tensor): Optional per-sample importance-sampling weights, e.g. from a `PrioritizedReplayBuffer`.
+    - discounts (torch.Tensor): Optional per-sample discounts for the bootstrapped value, e.g. from
+    `ReplayBuffer.sample_nstep_batch`. Replaces `gamma` when given.
 
     Returns:
     - loss_q (torch.Tensor): DDPG loss for the Q-function.
@@ -136,13 +141,17 @@ def ddpg_qfunc_loss(
     # Bellman backup for Q function
     with torch.no_grad():
         q_pi_targ = qfunc_target(o2, policy_target(o2))
-        backup = r + gamma * (1 - d) * q_pi_targ
+        discounts = gamma if discounts is None else discounts
+        backup = r + discounts * (1 - d) * q_pi_targ
 
     # MSE loss against Bellman backup
-    loss_q = ((q - backup) ** 2).mean()
+    td_error = q - backup
+    if weights is None:
+        weights = torch.ones_like(backup)
+    loss_q = (weights * td_error ** 2).mean()
 
-    # Useful info for logging
-    loss_info = dict(MeanQValues=q.mean().detach().numpy())
+    # Useful info for logging, and TD errors for updating replay priorities
+    loss_info = dict(MeanQValues=q.mean().detach().numpy(), TDErrors=td_error.abs().detach().numpy())
 
     return loss_q, loss_info
 
@@ -175,6 +184,8 @@ def td3_qfunc_loss(
     target_noise: Optional[float] = 0.2,
     noise_clip: Optional[float] = 0.5,
     gamma: Optional[float] = 0.99,
+    weights: Optional[torch.Tensor] = None,
+    discounts: Optional[torch.Tensor] = None,
     ):
     """
     Calculate Q-function loss for TD3 agent. See paper here: https://arxiv.org/abs/1802.09477
@@ -191,12 +202,15 @@ def td3_qfunc_loss(
     - target_noise (float): Noise to apply to policy target network.
     - noise_clip (float): Clip the noise within + and - this range.
     - gamma (float): Gamma discount factor.
+    - weights (torch.Tensor): Optional per-sample importance-sampling weights, e.g. from a `PrioritizedReplayBuffer`.
+    - discounts (torch.Tensor): Optional per-sample discounts for the bootstrapped value, e.g. from
+    `ReplayBuffer.sample_nstep_batch`. Replaces `gamma` when given.
 
     Returns:
     - loss_q (torch.Tensor): TD3 loss for the Q-function.
     - loss_info (dict): Dictionary containing useful loss info for logging.
     """
-    o, a, r, o2, d = data
+    o, o2, a, r, d = data
 
     q1 = qfunc1(o, a)
     q2 = qfunc2(o, a)
@@ -215,15 +229,20 @@ def td3_qfunc_loss(
         q1_pi_targ = qfunc1_target(o2, a2)
         q2_pi_targ = qfunc2_target(o2, a2)
         q_pi_targ = torch.min(q1_pi_targ, q2_pi_targ)
-        backup = r + gamma * (1 - d) * q_pi_targ
+        discounts = gamma if discounts is None else discounts
+        backup = r + discounts * (1 - d) * q_pi_targ
 
     # MSE loss against Bellman backup
-    loss_q1 = ((q1 - backup) ** 2).mean()
-    loss_q2 = ((q2 - backup) ** 2).mean()
+    td_error1, td_error2 = q1 - backup, q2 - backup
+    if weights is None:
+        weights = torch.ones_like(backup)
+    loss_q1 = (weights * td_error1 ** 2).mean()
+    loss_q2 = (weights * td_error2 ** 2).mean()
     loss_q = loss_q1 + loss_q2
+    td_errors = 0.5 * (td_error1.abs() + td_error2.abs())
 
-    # Useful info for logging
-    loss_info = dict(Q1Values=q1.detach().numpy(), Q2Values=q2.detach().numpy())
+    # Useful info for logging, and TD errors for updating replay priorities
+    loss_info = dict(Q1Values=q1.detach().numpy(), Q2Values=q2.detach().numpy(), TDErrors=td_errors.detach().numpy())
 
     return loss_q, loss_info
 
@@ -272,7 +291,9 @@ def sac_qfunc_loss(
     qfunc2_target: nn.Module,
     policy: nn.Module,
     gamma: Optional[float] = 0.99,
-    alpha: Optional[float] = 0.2
+    alpha: Optional[float] = 0.2,
+    weights: Optional[torch.Tensor] = None,
+    discounts: Optional[torch.Tensor] = None,
     ):
     """
     Q-function loss for Soft-Actor Critic agent.
@@ -287,12 +308,15 @@ def sac_qfunc_loss(
     - policy (nn.Module): Policy network.
     - gamma (float): Gamma discount factor.
     - alpha (float): Loss term alpha factor.
+    - weights (torch.Tensor): Optional per-sample importance-sampling weights, e.g. from a `PrioritizedReplayBuffer`.
+    - discounts (torch.Tensor): Optional per-sample discounts for the bootstrapped value, e.g. from
+    `ReplayBuffer.sample_nstep_batch`. Replaces `gamma` when given.
 
     Returns:
     - loss_q (torch.Tensor): SAC loss for the Q-function.
     - loss_info (dict): Dictionary containing useful loss info for logging.
     """
-    o, a, r, o2, d = data
+    o, o2, a, r, d = data
 
     q1 = qfunc1(o, a)
     q2 = qfunc2(o, a)
@@ -306,14 +330,19 @@ def sac_qfunc_loss(
         q1_pi_targ = qfunc1_target(o2, a2)
         q2_pi_targ = qfunc2_target(o2, a2)
         q_pi_targ = torch.min(q1_pi_targ, q2_pi_targ)
-        backup = r + gamma * (1 - d) * (q_pi_targ - alpha * logp_a2)
+        discounts = gamma if discounts is None else discounts
+        backup = r + discounts * (1 - d) * (q_pi_targ - alpha * logp_a2)
 
     # MSE loss against Bellman backup
-    loss_q1 = ((q1 - backup) ** 2).mean()
-    loss_q2 = ((q2 - backup) ** 2).mean()
+    td_error1, td_error2 = q1 - backup, q2 - backup
+    if weights is None:
+        weights = torch.ones_like(backup)
+    loss_q1 = (weights * td_error1 ** 2).mean()
+    loss_q2 = (weights * td_error2 ** 2).mean()
     loss_q = loss_q1 + loss_q2
+    td_errors = 0.5 * (td_error1.abs() + td_error2.abs())
 
-    # Useful info for logging
-    q_info = dict(Q1Values=q1.detach().numpy(), Q2Values=q2.detach().numpy())
+    # Useful info for logging, and TD errors for updating replay priorities
+    q_info = dict(Q1Values=q1.detach().numpy(), Q2Values=q2.detach().numpy(), TDErrors=td_errors.detach().numpy())
 
     return loss_q, q_info
\ No newline at end of file
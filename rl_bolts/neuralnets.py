@@ -8,9 +8,7 @@ from collections import namedtuple
 import torch
 import torch.nn as nn
 import torch.nn.functional as F
-from scipy import signal
 import gym
-from scipy.signal import lfilter
 from typing import Optional, Iterable, List, Dict, Callable, Union, Tuple
 from .env_wrappers import ToTorchWrapper
 from rl_bolts import utils
@@ -329,23 +327,25 @@ class ActorCritic(nn.Module):
             out_squeeze=True,
         )
 
-    def step(self, x: torch.Tensor):
+    def step(self, x: torch.Tensor, compute_value: Optional[bool] = True):
         """
         Get action, action log probability, and value estimate for an input state.
 
         Args:
         - x (torch.Tensor): input state.
+        - compute_value (bool): Whether to run the value function. If False, only the policy runs and the value is
+        None, so values can be computed later in one batch.
 
         Returns:
         - action (torch.Tensor): Action chosen by the policy.
         - logp_action (torch.Tensor): Log probability of that action chosen by the policy.
-        - value (torch.Tensor): Value estimate of the current state.
+        - value (torch.Tensor): Value estimate of the current state, or None if `compute_value` is False.
         """
         with torch.no_grad():
             policy = self.policy.action_distribution(x)
             action = policy.sample()
             logp_action = self.policy.logprob_from_distribution(policy, action)
-            value = self.value_f(x)
+            value = self.value_f(x) if compute_value else None
         return action, logp_action, value
 
     def act(self, x: torch.Tensor):
@@ -358,7 +358,7 @@ class ActorCritic(nn.Module):
         Returns:
         - action (torch.Tensor): Action chosen by the policy.
         """
-        return self.step(x)[0]
+        return self.step(x, compute_value=False)[0]
 
 # Cell
 
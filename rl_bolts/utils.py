@@ -1,7 +1,7 @@
 # AUTOGENERATED! DO NOT EDIT! File to edit: nbs/00_utils.ipynb (unless otherwise specified).
 
-__all__ = ['color2num', 'colorize', 'calc_logstd_anneal', 'save_frames_as_gif', 'conv2d_output_size', 'num2tuple',
-           'conv2d_output_shape', 'convtransp2d_output_shape', 'Saver', 'printdict']
+__all__ = ['color2num', 'colorize', 'calc_logstd_anneal', 'save_frames_as_gif', 'discount_cumsum', 'calc_gae',
+           'conv2d_output_size', 'num2tuple', 'conv2d_output_shape', 'convtransp2d_output_shape', 'Saver', 'printdict']
 
 # Cell
 import numpy as np
@@ -10,14 +10,12 @@ import torch.optim as optim
 import torch.nn as nn
 import sys
 import torch.nn.functional as F
-from scipy import signal
 import gym
 from gym import wrappers
 import math
-import scipy
 import matplotlib.pyplot as plt
 from matplotlib import animation
-from typing import Optional
+from typing import Optional, Union, Tuple
 from pathlib import Path
 import time
 import pickle as pkl
@@ -98,22 +96,88 @@ def save_frames_as_gif(frames, filename=None):
         anim.save(filename, writer="imagemagick")
 
 # Cell
-def _discount_cumsum(x: np.array, discount: float):
+def discount_cumsum(
+    x: torch.Tensor,
+    discount: float,
+    dones: Optional[torch.Tensor] = None
+) -> torch.Tensor:
     """
-    magic from rllab for computing discounted cumulative sums of vectors.
+    Compute discounted cumulative sums along the last dimension of a tensor, resetting the sum after done steps.
 
-    input:
-        vector x,
-        [x0,
-        x1,
-        x2]
+    Computes $y_t = x_t + discount * (1 - done_t) * y_{t+1}$ for every row of `x` at once, so a batch of
+    trajectories (or many episodes packed back to back, separated by the done mask) is handled in one call.
+    It runs as a parallel scan in $log_2(T)$ tensor operations instead of a Python loop over timesteps.
 
-    output:
-        [x0 + discount * x1 + discount^2 * x2,
-        x1 + discount * x2,
-        x2]
+    Args:
+    - x (torch.Tensor): Values to sum, shape (..., T).
+    - discount (float): Discount factor.
+    - dones (torch.Tensor): Optional done mask, same shape as x. 1 where an episode ends at that step.
+
+    Returns:
+    - y (torch.Tensor): Discounted cumulative sums, same shape as x.
+    """
+    y = torch.as_tensor(x, dtype=torch.float32).clone()
+    if dones is None:
+        coef = torch.full_like(y, float(discount))
+    else:
+        coef = float(discount) * (1. - torch.as_tensor(dones, dtype=torch.float32))
+    horizon = y.shape[-1]
+    offset = 1
+    while offset < horizon:
+        y[..., :-offset] = y[..., :-offset] + coef[..., :-offset] * y[..., offset:]
+        coef[..., :-offset] = coef[..., :-offset] * coef[..., offset:]
+        offset *= 2
+    return y
+
+# Cell
+def calc_gae(
+    rews: torch.Tensor,
+    vals: torch.Tensor,
+    last_val: Union[int, float, torch.Tensor],
+    gamma: float,
+    lam: float,
+    dones: Optional[torch.Tensor] = None
+) -> Tuple[torch.Tensor, torch.Tensor]:
+    """
+    Calculate GAE-Lambda advantages and rewards-to-go for one or more trajectories. See the paper: https://arxiv.org/abs/1506.02438
+
+    Episodes ending inside the trajectory are marked in `dones`; the advantage and return recursions are reset there, so
+    a whole rollout with many variable-length episodes is processed in a single call.
+
+    Args:
+    - rews (torch.Tensor): Rewards, shape (..., T).
+    - vals (torch.Tensor): Value estimates of the visited states, shape (..., T).
+    - last_val (int or float or torch.Tensor): Value estimate of the state following the last step, shape (...), or
+    any shape with as many elements, such as (1,) for a single trajectory. Scalars are broadcast. Should be 0 if the
+    trajectory ended in a terminal state.
+    - gamma (float): Discount factor.
+    - lam (float): Lambda parameter for GAE-Lambda.
+    - dones (torch.Tensor): Optional done mask, same shape as rews. 1 where an episode ends at that step.
+
+    Returns:
+    - advs (torch.Tensor): GAE-Lambda advantage estimates, same shape as rews.
+    - rets (torch.Tensor): Rewards-to-go, same shape as rews. Targets for the value function.
     """
-    return scipy.signal.lfilter([1], [1, float(-discount)], x[::-1], axis=0)[::-1]
+    rews = torch.as_tensor(rews, dtype=torch.float32)
+    vals = torch.as_tensor(vals, dtype=torch.float32)
+    last_val = torch.as_tensor(last_val, dtype=torch.float32)
+    batch_shape = rews.shape[:-1]
+    last_val = last_val.reshape(batch_shape) if last_val.numel() == batch_shape.numel() else last_val.expand(batch_shape)
+    last_val = last_val.unsqueeze(-1)
+    if dones is None:
+        dones = torch.zeros_like(rews)
+    dones = torch.as_tensor(dones, dtype=torch.float32)
+
+    next_vals = torch.cat([vals[..., 1:], last_val], dim=-1)
+    deltas = rews + gamma * (1. - dones) * next_vals - vals
+    advs = discount_cumsum(deltas, gamma * lam, dones)
+
+    rets = discount_cumsum(
+        torch.cat([rews, last_val], dim=-1),
+        gamma,
+        torch.cat([dones, torch.zeros_like(last_val)], dim=-1)
+    )[..., :-1]
+    return advs, rets
 
 # Cell
 def conv2d_output_size(kernel_size, stride, sidesize):